@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import requests
+
+
+# Release artifacts can be served from a mirror (or a local stand-in) by overriding the base URL
+RELEASE_BASE_URL = os.getenv(
+    "RAG_RELEASE_BASE_URL",
+    "https://github.com/RajaMuhammadHammad/Ed-Watch-AI/releases/download/v1.0.0",
+)
+
+CHUNK_SIZE = 1024 * 1024
+# (connect, read) timeouts for the release download
+TIMEOUT = (10, 60)
+
+log = logging.getLogger(__name__)
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def sha256_of(filepath, chunk_size=CHUNK_SIZE, h=None):
+    h = h or hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h
+
+
+class ArtifactManager:
+    def __init__(self, session=None, chunk_size=CHUNK_SIZE, timeout=TIMEOUT, retries=3):
+        self.session = session or requests.Session()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+
+    def verify(self, filepath, sha256):
+        if not sha256:
+            return True
+        return sha256_of(filepath, self.chunk_size).hexdigest() == sha256.lower()
+
+    def ensure(self, url, filepath, sha256=None):
+        # ✅ Existing file is only trusted if it matches the pinned hash
+        if os.path.exists(filepath):
+            if self.verify(filepath, sha256):
+                return filepath
+            log.warning("Checksum mismatch for %s, re-fetching", filepath)
+            os.remove(filepath)
+
+        last_error = None
+        for attempt in range(1, self.retries + 1):
+            try:
+                self._fetch(url, filepath, sha256)
+                return filepath
+            except (requests.RequestException, ArtifactError) as e:
+                last_error = e
+                log.warning("Attempt %d/%d for %s failed: %s", attempt, self.retries, url, e)
+        raise ArtifactError(f"Could not fetch {url}: {last_error}")
+
+    def _fetch(self, url, filepath, sha256):
+        part_path = filepath + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        log.info("Fetching %s (resume from %d bytes)", url, offset) if offset else log.info("Fetching %s", url)
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if offset and r.status_code == 416:
+                # Partial file is stale or already complete, start over
+                os.remove(part_path)
+                raise ArtifactError("Range not satisfiable, restarting download")
+            r.raise_for_status()
+
+            if offset and r.status_code == 206:
+                h = sha256_of(part_path, self.chunk_size)
+                mode = "ab"
+            else:
+                # Server ignored the range request, rewrite from the beginning
+                h = hashlib.sha256()
+                mode = "wb"
+
+            with open(part_path, mode) as f:
+                for block in r.iter_content(chunk_size=self.chunk_size):
+                    if block:
+                        f.write(block)
+                        h.update(block)
+                f.flush()
+                os.fsync(f.fileno())
+
+        if sha256 and h.hexdigest() != sha256.lower():
+            os.remove(part_path)
+            raise ArtifactError(f"SHA-256 mismatch for {url}: got {h.hexdigest()}")
+
+        # ✅ Atomic rename: a half-written file is never visible under the final name
+        os.replace(part_path, filepath)
+        log.info("Saved to %s", filepath)
+
+
+def read_faiss_index(filepath, mmap=True):
+    import faiss
+
+    if mmap:
+        # Memory-mapped and read-only: workers share one page-cached copy of the index.
+        # IO_FLAG_MMAP only maps IVF inverted lists; flat codes (IndexFlat, HNSW storage, and IVF
+        # lists on newer faiss) need IO_FLAG_MMAP_IFC
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            index = faiss.read_index(filepath, flags)
+        except RuntimeError as e:
+            # Not every index type supports mmap, fall back to a heap copy
+            log.warning("mmap load not supported for %s (%s), reading into memory", filepath, e)
+        else:
+            if index_mapped(index) is False:
+                log.warning("%s was loaded onto the heap, each worker holds its own copy", filepath)
+            return index
+    return faiss.read_index(filepath)
+
+
+def index_mapped(index):
+    # Whether the index's vectors/codes live in the mapped file: True, False, or None when the
+    # layout is not one we know how to inspect
+    import faiss
+
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexPreTransform):
+        base = faiss.downcast_index(base.index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, faiss.IndexFlatCodes):
+        return _view(base.codes)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        lists = faiss.downcast_InvertedLists(ivf.invlists)
+        if isinstance(lists, faiss.OnDiskInvertedLists):
+            return True
+        if isinstance(lists, faiss.ArrayInvertedLists):
+            for i in range(lists.nlist):
+                if lists.list_size(i):
+                    return _view(lists.codes.at(i))
+    return None
+
+
+def _view(codes):
+    # faiss < 1.10 keeps codes in a plain std::vector, which is always a heap copy
+    owned = getattr(codes, "is_owned", True)
+    return not owned
@@ -0,0 +1,206 @@
+# Offline stand-ins for the pieces of the report pipeline that normally need the network:
+# a synthetic corpus + FAISS index, a hashing encoder, a fake Gemini model and
+# questionnaire payloads shaped like the ones static/chatbot.js submits.
+# Record fresh payloads (from the repo root): python benchmarks/fakes.py [count] [output path]
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import numpy as np
+from docstore import DocumentStore, write_store
+from metadata_index import MetadataIndex
+from pdf_render import SECTION_TITLES
+from prompts import CHATBOT_JS, questionnaire_fields
+from rag_engine import RAGEngine
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PAYLOADS_PATH = os.path.join(BENCH_DIR, "payloads.json")
+
+TOKEN = re.compile(r"\w+")
+
+TOPICS = [
+    "scope 1 and scope 2 emissions", "scope 3 supplier engagement", "renewable power purchase agreements",
+    "TCFD scenario analysis", "CSRD double materiality", "GRI 305 disclosures", "SASB industry standards",
+    "science based targets", "internal carbon pricing", "water withdrawal in stressed basins",
+    "waste diversion and circularity", "green building certification", "board oversight of climate risk",
+    "sustainability linked loans", "ISO 14001 environmental management", "biodiversity and TNFD",
+]
+SECTORS = ["manufacturing", "technology", "retail", "energy", "logistics", "healthcare", "construction", "finance"]
+REGIONS = ["Europe", "North America", "the Middle East", "Southeast Asia", "Latin America", "Africa"]
+
+
+# ---------- corpus, encoder, index ----------
+def synthetic_corpus(n_docs, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(n_docs):
+        topic, sector, region = rng.choice(TOPICS), rng.choice(SECTORS), rng.choice(REGIONS)
+        sentences = [
+            f"Leading {sector} companies in {region} report on {topic} as part of their sustainability roadmap.",
+            f"Best practice is to set time-bound targets for {rng.choice(TOPICS)} and to disclose progress annually.",
+            f"Regulators increasingly expect {rng.choice(TOPICS)} to be covered by board-level governance.",
+        ]
+        body = " ".join(rng.choice(sentences) for _ in range(rng.randint(3, 12)))
+        docs.append({"content": body, "source": f"synthetic/{i // 50:04d}.pdf", "page": i % 50})
+    return docs
+
+
+class HashEncoder:
+    # Deterministic bag-of-words hashing into `dim` dimensions: texts sharing words land close
+    # together, so search and de-duplication behave sensibly without a real model
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            for token in TOKEN.findall(text.lower()):
+                h = zlib.crc32(token.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+def load_encoder(name, dim):
+    if name == "hash":
+        return HashEncoder(dim)
+    if name == "onnx":
+        # int8 export from encoders.py, in RAG_ONNX_DIR
+        from encoders import OnnxEncoder
+        return OnnxEncoder()
+    # Real model from the local Hugging Face cache (HF_HUB_OFFLINE=1 keeps it offline)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def make_engine(workdir, n_docs=5000, encoder=None, seed=0, query_cache_size=0):
+    # A ready RAGEngine over a synthetic corpus; the query cache is off by default so
+    # every search is measured cold
+    encoder = encoder or HashEncoder()
+    docs = synthetic_corpus(n_docs, seed)
+    store_path = os.path.join(workdir, "bench.store")
+    write_store(docs, store_path)
+
+    vectors = np.asarray(encoder.encode([d["content"] for d in docs], batch_size=256), dtype="float32")
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+
+    documents = DocumentStore(store_path)
+    engine = RAGEngine(query_cache_size=query_cache_size, microbatch_wait_ms=0)
+    return engine.attach(index, documents, encoder, metadata=MetadataIndex.build(documents))
+
+
+# ---------- fake Gemini ----------
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    # Same call shape as genai.GenerativeModel.generate_content. Returns a canned 14-section
+    # report (in ```html fences, like Gemini does) after `latency` seconds; the content is
+    # seeded by the prompt, so the same prompt always gets the same report.
+    def __init__(self, latency=1.0, stream_chunks=40, paragraphs=3):
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.paragraphs = paragraphs
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        text = "```html\n" + canned_report(seed, self.paragraphs) + "\n```"
+        if not stream:
+            time.sleep(self.latency)
+            return FakeResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        size = max(1, len(text) // self.stream_chunks)
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / self.stream_chunks)
+            yield FakeResponse(text[start:start + size])
+
+
+def canned_report(seed=0, paragraphs=3):
+    rng = random.Random(seed)
+    parts = []
+    for number, title in enumerate(SECTION_TITLES, start=1):
+        parts.append(f"<h2>{number}. {title}</h2>")
+        parts.append("<div class='section-box'>")
+        for heading in ("Current Status", "Expert Analysis & Gap Identification", "Actionable Recommendations"):
+            parts.append(f"<h3>{heading}</h3>")
+            for _ in range(paragraphs):
+                parts.append(f"<p>The company addresses {rng.choice(TOPICS)} in {rng.choice(REGIONS)}; "
+                             f"peers in {rng.choice(SECTORS)} already disclose {rng.choice(TOPICS)} and "
+                             f"link it to {rng.choice(TOPICS)}.</p>")
+            parts.append("<ul>" + "".join(f"<li>Prioritise {rng.choice(TOPICS)}.</li>" for _ in range(3)) + "</ul>")
+        if number in (12, 13):
+            rows = "".join(
+                f"<tr><td style='border:1px solid #ccc;padding:4px;'>{year}</td>"
+                f"<td style='border:1px solid #ccc;padding:4px;'>{rng.choice(TOPICS)}</td></tr>"
+                for year in range(2026, 2031)
+            )
+            parts.append("<div style=\"page-break-inside: avoid;\"><table style=\"page-break-inside: avoid; "
+                         f"width:100%; border-collapse: collapse;\">{rows}</table></div>")
+        parts.append("</div>")
+    return "\n".join(parts)
+
+
+# ---------- questionnaire payloads ----------
+FREE_TEXT = {
+    "company_name": ["Acme Industries", "Northwind Traders", "Globex Corporation", "Initech", "Umbrella Foods"],
+    "major_countries": ["UAE, KSA", "Germany, France, Poland", "USA, Canada", "India, Sri Lanka", "Kenya, Nigeria"],
+    "sector_industry": ["Manufacturing", "Renewable Energy", "Pharmaceuticals", "AgriTech", "Logistics", "Retail"],
+    "total_emissions": ["1200", "45000", "350", "98000", "Not measured"],
+    "email": ["esg@example.com"],
+    "Name": ["Sam Example"],
+    "Phone_number": ["+10000000000"],
+}
+
+
+def record_payload(fields, rng):
+    data, total = {}, 0
+    for field, options, scored in fields:
+        if options is None:
+            data[field] = rng.choice(FREE_TEXT.get(field, ["N/A"]))
+            continue
+        index = rng.randrange(len(options))
+        data[field] = options[index]
+        if scored:
+            total += index
+    # Same scoring as calculateScore() in chatbot.js
+    level = 1 if total <= 5 else 2 if total <= 34 else 3 if total <= 68 else 4
+    data["score_total"] = total
+    data["score_level"] = level
+    data["score_level_name"] = {1: "Starter", 2: "Builder", 3: "Performer", 4: "Industry Leader"}[level]
+    data["confidence"] = round(total * 2 / 204 * 100, 2)
+    return data
+
+
+def record_payloads(count=8, seed=0, js_path=CHATBOT_JS):
+    rng = random.Random(seed)
+    fields = questionnaire_fields(js_path)
+    return [record_payload(fields, rng) for _ in range(count)]
+
+
+def load_payloads(path=PAYLOADS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    path = sys.argv[2] if len(sys.argv) > 2 else PAYLOADS_PATH
+    payloads = record_payloads(count)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payloads, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"Recorded {len(payloads)} payloads with {len(payloads[0])} fields -> {path}")
@@ -0,0 +1,63 @@
+# Per-page and per-document cost of the /download compositing step, legacy vs preloaded.
+# Usage (from the repo root): python benchmarks/pdf_compositing.py [pages ...]
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from pdf_render import APPENDIX_PATH, COVER_PATH, TEMPLATE_PATH, PDFAssets
+
+
+def make_content(pages):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{i + 1}. Section heading", fontsize=20)
+        for line in range(40):
+            page.insert_text((72, 110 + line * 16), "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 2, fontsize=9)
+    return doc.tobytes()
+
+
+def legacy_composite(content_pdf):
+    # What download_pdf did before: reopen every asset from disk and save via BytesIO
+    template_doc = fitz.open(TEMPLATE_PATH)
+    content_doc = fitz.open("pdf", content_pdf)
+    final_pdf = fitz.open()
+    if os.path.exists(COVER_PATH):
+        final_pdf.insert_pdf(fitz.open(COVER_PATH))
+    for i, page in enumerate(content_doc):
+        bg_page = template_doc[0]
+        new_page = final_pdf.new_page(width=bg_page.rect.width, height=bg_page.rect.height)
+        new_page.show_pdf_page(bg_page.rect, template_doc, 0)
+        new_page.show_pdf_page(bg_page.rect, content_doc, i)
+    if os.path.exists(APPENDIX_PATH):
+        final_pdf.insert_pdf(fitz.open(APPENDIX_PATH))
+    output = BytesIO()
+    final_pdf.save(output)
+    output.seek(0)
+    return output.getvalue()
+
+
+def timed(fn, content_pdf, repeat):
+    fn(content_pdf)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(content_pdf)
+    return (time.perf_counter() - start) / repeat, len(out)
+
+
+def main(page_counts, repeat=5):
+    assets = PDFAssets()
+    print(f"{'pages':>5} {'variant':>10} {'ms/doc':>9} {'ms/page':>9} {'size KB':>9}")
+    for pages in page_counts:
+        content_pdf = make_content(pages)
+        for name, fn in (("legacy", legacy_composite), ("preloaded", assets.composite)):
+            seconds, size = timed(fn, content_pdf, repeat)
+            print(f"{pages:>5} {name:>10} {seconds * 1000:>9.1f} {seconds * 1000 / pages:>9.2f} {size / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main([int(p) for p in sys.argv[1:]] or [10, 30, 60])
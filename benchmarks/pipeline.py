@@ -0,0 +1,280 @@
+# Offline latency/throughput benchmark for the report pipeline: embedding, FAISS search, context
+# building, prompt build, LLM (fake, fixed latency), HTML cleanup, xhtml2pdf render and template
+# compositing, each measured on its own at several concurrency levels, plus the whole pipeline.
+# Usage (from the repo root):
+#   python benchmarks/pipeline.py [--docs 5000] [--requests 16] [--concurrency 1,4,8] [--out results.json]
+#   python benchmarks/pipeline.py --diff old.json new.json
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import fitz  # PyMuPDF
+import numpy as np
+import xhtml2pdf
+import pdf_render
+from context_builder import CONTEXT_CANDIDATES, build_context
+from metadata_index import FILTERS_ENABLED, query_filters
+from prompts import build_prompt
+from rag_engine import build_query
+from streaming import clean_fences
+from fakes import PAYLOADS_PATH, FakeGenerativeModel, load_encoder, load_payloads, make_engine
+
+
+STAGES = ["embedding", "search", "context", "prompt", "llm", "cleanup", "render", "composite"]
+REPORT_DATE = "January 01, 2026"
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors[name] += 1
+            raise
+        with self._lock:
+            self.samples[name].append(time.perf_counter() - start)
+
+
+def summarize(samples, errors, wall):
+    ms = np.array(samples) * 1000 if samples else np.zeros(1)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(samples) / wall, 3) if wall else None,
+        "wall_s": round(wall, 3),
+    }
+
+
+class Pipeline:
+    # The same steps app.build_report + /download run, split so each can be timed on its own
+    def __init__(self, engine, llm, assets, parallel_pdf=False):
+        self.engine = engine
+        self.llm = llm
+        self.assets = assets
+        self.parallel_pdf = parallel_pdf
+
+    def query(self, payload):
+        return build_query(payload.get("company_size", ""), payload.get("sector_industry", ""),
+                           payload.get("region", ""))
+
+    def embedding(self, query):
+        return np.asarray(self.engine.model.encode([query]), dtype="float32")
+
+    def search(self, vector):
+        return self.engine.faiss_index.search(vector, CONTEXT_CANDIDATES)
+
+    def context(self, query, filters=None):
+        return build_context(self.engine, query, filters=filters).text
+
+    def prompt(self, payload, rag_context):
+        return build_prompt(payload, rag_context, REPORT_DATE)
+
+    def llm_call(self, prompt):
+        return self.llm.generate_content(prompt, request_options={"timeout": 180}).text
+
+    def cleanup(self, text):
+        return pdf_render.clean_report_html(clean_fences(text).strip())
+
+    def render(self, cleaned):
+        if self.parallel_pdf:
+            return pdf_render.html_to_pdf_parallel(cleaned).tobytes()
+        return pdf_render._pisa(pdf_render.wrap_html(cleaned))
+
+    def composite(self, content_pdf):
+        return self.assets.composite(content_pdf)
+
+    def end_to_end(self, payload, rec):
+        query = self.query(payload)
+        with rec.stage("context"):
+            rag_context = self.context(query, query_filters(payload) if FILTERS_ENABLED else None)
+        with rec.stage("prompt"):
+            prompt = self.prompt(payload, rag_context)
+        with rec.stage("llm"):
+            text = self.llm_call(prompt)
+        with rec.stage("cleanup"):
+            cleaned = self.cleanup(text)
+        with rec.stage("render"):
+            content_pdf = self.render(cleaned)
+        if self.assets.template is not None:
+            with rec.stage("composite"):
+                self.composite(content_pdf)
+
+
+def run_phase(name, fn, inputs, concurrency, rec):
+    def call(item):
+        with rec.stage(name):
+            return fn(*item)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = list(pool.map(call, inputs))
+    return outputs, time.perf_counter() - start
+
+
+def run_level(pipeline, payloads, concurrency):
+    # Each stage runs over the outputs of the previous one, so inputs stay realistic
+    results = {}
+    rec = Recorder()
+    stage_inputs = [(p,) for p in payloads]
+    queries = [(pipeline.query(p),) for p in payloads]
+
+    phases = [
+        ("embedding", pipeline.embedding, lambda: queries),
+        ("search", pipeline.search, lambda: [(v,) for v in outputs["embedding"]]),
+        ("context", pipeline.context,
+         lambda: [(q, query_filters(p) if FILTERS_ENABLED else None) for (q,), p in zip(queries, payloads)]),
+        ("prompt", pipeline.prompt, lambda: [(p, c) for p, c in zip(payloads, outputs["context"])]),
+        ("llm", pipeline.llm_call, lambda: [(p,) for p in outputs["prompt"]]),
+        ("cleanup", pipeline.cleanup, lambda: [(t,) for t in outputs["llm"]]),
+        ("render", pipeline.render, lambda: [(h,) for h in outputs["cleanup"]]),
+        ("composite", pipeline.composite, lambda: [(pdf,) for pdf in outputs["render"]]),
+    ]
+    outputs = {}
+    for name, fn, inputs in phases:
+        if name == "composite" and pipeline.assets.template is None:
+            continue
+        outputs[name], wall = run_phase(name, fn, inputs(), concurrency, rec)
+        results[name] = summarize(rec.samples[name], rec.errors[name], wall)
+
+    e2e = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda item: timed_request(pipeline, item[0], e2e), stage_inputs))
+    wall = time.perf_counter() - start
+    results["end_to_end"] = summarize(e2e.samples["total"], e2e.errors["total"], wall)
+    results["end_to_end"]["stages"] = {
+        name: summarize(e2e.samples[name], e2e.errors[name], wall)
+        for name in STAGES if name in e2e.samples
+    }
+    return results
+
+
+def timed_request(pipeline, payload, rec):
+    with rec.stage("total"):
+        pipeline.end_to_end(payload, rec)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'conc':>4} {'stage':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>9}")
+    for level, stages in results.items():
+        for name, s in stages.items():
+            print(f"{level:>4} {name:>12} {s['p50_ms']:>10.1f} {s['p95_ms']:>10.1f} {s['p99_ms']:>10.1f} "
+                  f"{s['throughput_per_s']:>9.2f}")
+
+
+def diff(old, new, metric="p95_ms"):
+    # Relative change per stage and level between two result files (positive = slower)
+    print(f"{'conc':>4} {'stage':>12} {'old ' + metric:>14} {'new ' + metric:>14} {'change':>8}")
+    for level, stages in new["results"].items():
+        for name, s in stages.items():
+            before = old["results"].get(level, {}).get(name)
+            if before is None:
+                continue
+            change = (s[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f"{level:>4} {name:>12} {before[metric]:>14.1f} {s[metric]:>14.1f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=5000, help="synthetic documents in the index")
+    parser.add_argument("--dim", type=int, default=384, help="embedding size of the hashing encoder")
+    parser.add_argument("--encoder", default="hash",
+                        help="'hash', 'onnx' (export in RAG_ONNX_DIR), or a sentence-transformers model name "
+                             "from the local cache")
+    parser.add_argument("--requests", type=int, default=16, help="requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma separated concurrency levels")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per fake completion")
+    parser.add_argument("--paragraphs", type=int, default=3, help="paragraphs per subsection in the fake report")
+    parser.add_argument("--parallel-pdf", action="store_true", help="render with the process-pool renderer")
+    parser.add_argument("--payloads", default=PAYLOADS_PATH)
+    parser.add_argument("--out", default="pipeline-results.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.diff:
+        with open(args.diff[0]) as f_old, open(args.diff[1]) as f_new:
+            diff(json.load(f_old), json.load(f_new))
+        return
+
+    logging.getLogger("xhtml2pdf").setLevel(logging.ERROR)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    recorded = load_payloads(args.payloads)
+    payloads = [recorded[i % len(recorded)] for i in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        engine = make_engine(workdir, args.docs, load_encoder(args.encoder, args.dim))
+        setup_s = time.perf_counter() - start
+        pipeline = Pipeline(engine, FakeGenerativeModel(args.llm_latency, paragraphs=args.paragraphs),
+                            pdf_render.PDFAssets(), parallel_pdf=args.parallel_pdf)
+        if pipeline.assets.template is None:
+            print("Template PDF not found, skipping the composite stage")
+
+        results = {}
+        for level in levels:
+            print(f"Concurrency {level}: {len(payloads)} requests ...", flush=True)
+            results[str(level)] = run_level(pipeline, payloads, level)
+        engine.documents.close()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "versions": {"numpy": np.__version__, "faiss": faiss.__version__,
+                         "pymupdf": fitz.VersionBind, "xhtml2pdf": xhtml2pdf.__version__},
+            "config": {key: value for key, value in vars(args).items() if key not in ("out", "baseline", "diff")},
+            "setup_s": round(setup_s, 3),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+    print_table(results)
+    print(f"Results -> {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            diff(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
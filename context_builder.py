@@ -0,0 +1,150 @@
+import logging
+import os
+import re
+import numpy as np
+from metrics import CONTEXT_CHARS
+
+
+# Over-fetch this many candidates, then keep at most CONTEXT_MAX_CHUNKS of them
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "5"))
+# Prompt budget for the RAG block, in approximate tokens (~4 characters per token)
+CONTEXT_BUDGET_TOKENS = int(os.getenv("CONTEXT_BUDGET_TOKENS", "1500"))
+# Drop candidates whose FAISS distance is above this, or whose score is below it on an
+# inner-product index (unset = no cutoff)
+CONTEXT_MAX_DISTANCE = float(os.getenv("CONTEXT_MAX_DISTANCE")) if os.getenv("CONTEXT_MAX_DISTANCE") else None
+# MMR trade-off between relevance (1.0) and novelty (0.0)
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Candidates at least this similar to an already kept chunk count as duplicates
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.92"))
+
+CHARS_PER_TOKEN = 4
+
+log = logging.getLogger(__name__)
+WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Context:
+    def __init__(self, text, kept, dropped):
+        self.text = text
+        self.kept = kept
+        self.dropped = dropped
+
+    @property
+    def tokens(self):
+        return estimate_tokens(self.text)
+
+    def summary(self):
+        return {
+            "chunks": len(self.kept),
+            "chars": len(self.text),
+            "tokens": self.tokens,
+            "kept": self.kept,
+            "dropped": self.dropped,
+        }
+
+
+def _cosine_matrix(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    return unit @ unit.T
+
+
+def _jaccard_matrix(texts):
+    # Fallback when the index cannot hand back stored vectors: word-set overlap
+    sets = [set(WORD.findall(t.lower())) for t in texts]
+    n = len(sets)
+    sim = np.eye(n, dtype="float32")
+    for a in range(n):
+        for b in range(a + 1, n):
+            union = len(sets[a] | sets[b])
+            sim[a, b] = sim[b, a] = len(sets[a] & sets[b]) / union if union else 0.0
+    return sim
+
+
+def select(candidates, similarity, max_chunks, budget_chars, max_distance=None,
+           mmr_lambda=CONTEXT_MMR_LAMBDA, dedup_threshold=CONTEXT_DEDUP_THRESHOLD, higher_is_better=False):
+    # candidates: [(id, distance, content)] in FAISS order (best first); similarity: pairwise matrix.
+    # higher_is_better: the index scores by inner product, so a larger value is more relevant
+    dropped = []
+    pool = []
+    for pos, (doc_id, distance, content) in enumerate(candidates):
+        too_far = max_distance is not None and (distance < max_distance if higher_is_better else distance > max_distance)
+        if not content.strip():
+            dropped.append({"id": doc_id, "reason": "empty"})
+        elif too_far and pos > 0:
+            # The nearest chunk is always allowed so the prompt never loses its context entirely
+            dropped.append({"id": doc_id, "reason": "distance", "distance": round(distance, 4)})
+        else:
+            pool.append(pos)
+
+    if not pool:
+        return [], dropped
+
+    # Relevance in [0, 1] from the FAISS scores: smaller distance, or larger inner product, is better
+    distances = np.array([candidates[pos][1] for pos in pool], dtype="float32")
+    spread = float(distances.max() - distances.min())
+    best = float(distances.max() if higher_is_better else distances.min())
+    relevance = {pos: 1.0 - abs(candidates[pos][1] - best) / spread if spread else 1.0 for pos in pool}
+
+    kept = []
+    used = 0
+    while pool and len(kept) < max_chunks:
+        # Maximal marginal relevance: relevant, but unlike what is already kept
+        def mmr(pos):
+            redundancy = max((similarity[pos, k] for k in kept), default=0.0)
+            return mmr_lambda * relevance[pos] - (1 - mmr_lambda) * redundancy
+
+        best = max(pool, key=mmr)
+        pool.remove(best)
+        doc_id, distance, content = candidates[best]
+
+        redundancy = max((similarity[best, k] for k in kept), default=0.0)
+        if redundancy >= dedup_threshold:
+            dropped.append({"id": doc_id, "reason": "duplicate", "similarity": round(float(redundancy), 4)})
+            continue
+
+        remaining = budget_chars - used
+        if remaining <= 0:
+            dropped.append({"id": doc_id, "reason": "budget"})
+            continue
+        if len(content) > remaining:
+            if kept:
+                dropped.append({"id": doc_id, "reason": "budget"})
+                continue
+            # First chunk alone is over budget: keep its head rather than nothing
+            content = content[:remaining]
+            candidates[best] = (doc_id, distance, content)
+
+        kept.append(best)
+        used += len(content) + 2
+
+    for pos in pool:
+        dropped.append({"id": candidates[pos][0], "reason": "not_selected"})
+    return kept, dropped
+
+
+def build_context(engine, query, max_chunks=CONTEXT_MAX_CHUNKS, candidates=CONTEXT_CANDIDATES,
+                  budget_tokens=CONTEXT_BUDGET_TOKENS, max_distance=CONTEXT_MAX_DISTANCE, filters=None):
+    scored = engine.retrieve_scored(query, top_k=max(candidates, max_chunks), filters=filters)
+    rows = [(doc_id, distance, doc.get("content", "")) for doc_id, distance, doc in scored]
+
+    vectors = engine.vectors([doc_id for doc_id, _, _ in rows]) if rows else None
+    similarity = _cosine_matrix(vectors) if vectors is not None else _jaccard_matrix([r[2] for r in rows])
+
+    kept, dropped = select(rows, similarity, max_chunks, budget_tokens * CHARS_PER_TOKEN, max_distance,
+                           higher_is_better=engine.higher_is_better())
+
+    # Keep the chunks in relevance order in the prompt
+    kept.sort()
+    text = "\n\n".join(rows[pos][2] for pos in kept)
+    kept_info = [{"id": rows[pos][0], "distance": round(rows[pos][1], 4), "chars": len(rows[pos][2])} for pos in kept]
+
+    context = Context(text, kept_info, dropped)
+    CONTEXT_CHARS.observe(len(text))
+    log.info("Context: kept %d/%d chunks, %d chars (~%d tokens)", len(kept), len(rows), len(text), context.tokens)
+    return context
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import sys
+import numpy as np
+
+
+# Single-file, mmap-friendly document store:
+#   MAGIC | uint64 header length | JSON header | 8-byte aligned columns
+# Every column is an int64 offset array (count + 1 entries) followed by one UTF-8 blob,
+# so reading document i is two offset lookups and one slice.
+MAGIC = b"EDWDOCS1"
+ALIGN = 8
+
+log = logging.getLogger(__name__)
+
+
+def _normalize(doc):
+    if isinstance(doc, dict):
+        return doc
+    if isinstance(doc, str):
+        return {"content": doc}
+    return {"content": str(doc)}
+
+
+class _HashingWriter:
+    # File wrapper that hashes everything written, so the store's digest costs no second read
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell()
+
+
+def digest_path(path):
+    return path + ".sha256"
+
+
+def store_digest(path):
+    # SHA-256 of a store, as recorded next to it by write_store (hashed and recorded once otherwise)
+    try:
+        if os.path.getmtime(digest_path(path)) >= os.path.getmtime(path):
+            with open(digest_path(path), encoding="utf-8") as f:
+                return f.read().split()[0]
+    except (OSError, IndexError):
+        pass
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    record_digest(path, h.hexdigest())
+    return h.hexdigest()
+
+
+def record_digest(path, digest):
+    try:
+        with open(digest_path(path), "w", encoding="utf-8") as f:
+            f.write(f"{digest}  {os.path.basename(path)}\n")
+    except OSError as e:
+        log.warning("Could not record the digest of %s: %s", path, e)
+
+
+def _pad(f):
+    pos = f.tell()
+    if pos % ALIGN:
+        f.write(b"\0" * (ALIGN - pos % ALIGN))
+
+
+def write_store(documents, path):
+    documents = [_normalize(d) for d in documents]
+
+    # "content" always comes first; other keys become optional columns
+    names = ["content"]
+    for doc in documents:
+        for key in doc:
+            if key not in names:
+                names.append(key)
+
+    columns = []
+    for name in names:
+        values = [doc.get(name) for doc in documents]
+        # Plain strings are stored as-is, anything else (dicts, lists, numbers) as JSON
+        kind = "str" if all(v is None or isinstance(v, str) for v in values) else "json"
+        encoded = []
+        for v in values:
+            if v is None:
+                encoded.append(b"")
+            elif kind == "str":
+                encoded.append(v.encode("utf-8"))
+            else:
+                encoded.append(json.dumps(v, ensure_ascii=False).encode("utf-8"))
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        present = None
+        if any(v is None for v in values):
+            present = np.array([v is not None for v in values], dtype=np.uint8)
+        columns.append((name, kind, offsets, b"".join(encoded), present))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        f = _HashingWriter(raw)
+        # Lay out the columns first so the header can be written up front
+        header = {"count": len(documents), "columns": []}
+        layout = []
+        pos = 0
+        for name, kind, offsets, blob, present in columns:
+            entry = {"name": name, "kind": kind}
+            entry["offsets_at"] = pos
+            pos += offsets.nbytes
+            entry["data_at"] = pos
+            entry["data_len"] = len(blob)
+            pos += len(blob)
+            pos += (-pos) % ALIGN
+            if present is not None:
+                entry["present_at"] = pos
+                pos += present.nbytes
+                pos += (-pos) % ALIGN
+            layout.append(entry)
+        header["columns"] = layout
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        _pad(f)
+        base = f.tell()
+        for (name, kind, offsets, blob, present), entry in zip(columns, layout):
+            assert f.tell() - base == entry["offsets_at"]
+            f.write(offsets.tobytes())
+            f.write(blob)
+            _pad(f)
+            if present is not None:
+                f.write(present.tobytes())
+                _pad(f)
+    os.replace(tmp_path, path)
+    record_digest(path, f.sha256.hexdigest())
+    return path
+
+
+def convert_pickle(pkl_path, store_path):
+    # Conversion from the legacy documents.pkl release file: at boot when no prebuilt store is
+    # configured, or when publishing one
+    with open(pkl_path, "rb") as f:
+        documents = pickle.load(f)
+    write_store(documents, store_path)
+    log.info("Converted %d documents from %s to %s", len(documents), pkl_path, store_path)
+    return store_path
+
+
+class DocumentStore:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a document store")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        header_at = len(MAGIC) + 8
+        header = json.loads(self._mm[header_at:header_at + header_len])
+        base = header_at + header_len
+        base += (-base) % ALIGN
+
+        self.count = header["count"]
+        self.columns = {}
+        for entry in header["columns"]:
+            offsets = np.frombuffer(self._mm, dtype=np.int64, count=self.count + 1,
+                                    offset=base + entry["offsets_at"])
+            present = None
+            if "present_at" in entry:
+                present = np.frombuffer(self._mm, dtype=np.uint8, count=self.count,
+                                        offset=base + entry["present_at"])
+            self.columns[entry["name"]] = (entry["kind"], offsets, base + entry["data_at"], present)
+
+    def __len__(self):
+        return self.count
+
+    def field(self, i, name):
+        kind, offsets, data_at, present = self.columns[name]
+        if present is not None and not present[i]:
+            return None
+        raw = self._mm[data_at + int(offsets[i]):data_at + int(offsets[i + 1])]
+        text = raw.decode("utf-8")
+        return text if kind == "str" else json.loads(text)
+
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        doc = {}
+        for name in self.columns:
+            value = self.field(i, name)
+            if value is not None or name == "content":
+                doc[name] = value if value is not None else ""
+        return doc
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        # Drop the numpy views first, mmap refuses to close while buffers are exported
+        self.columns = {}
+        self._mm.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    # Usage: python docstore.py documents.pkl documents.store
+    if len(sys.argv) != 3:
+        print("Usage: python docstore.py <documents.pkl> <documents.store>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    convert_pickle(sys.argv[1], sys.argv[2])
+    # Pin this as RAG_DOCSTORE_SHA256 when publishing the store with the release
+    print(f"sha256 {store_digest(sys.argv[2])}  {sys.argv[2]}")
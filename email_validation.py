@@ -0,0 +1,202 @@
+import os
+import re
+import socket
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import requests
+from requests.adapters import HTTPAdapter
+from cache import TTLCache
+from metrics import EMAIL_VALIDATIONS
+
+
+# Point at a local stub to test without the real API, e.g. EMAIL_VALIDATION_URL=http://127.0.0.1:8081/
+EMAIL_VALIDATION_URL = os.getenv("EMAIL_VALIDATION_URL", "https://emailreputation.abstractapi.com/v1/")
+# (connect, read) seconds; a slow upstream can no longer pin a web worker
+EMAIL_CONNECT_TIMEOUT = float(os.getenv("EMAIL_CONNECT_TIMEOUT", "2"))
+EMAIL_READ_TIMEOUT = float(os.getenv("EMAIL_READ_TIMEOUT", "5"))
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "10"))
+EMAIL_CACHE_SIZE = int(os.getenv("EMAIL_CACHE_SIZE", "10000"))
+EMAIL_CACHE_TTL = int(os.getenv("EMAIL_CACHE_TTL", str(24 * 3600)))
+# Domain verdicts (no MX, does not resolve) apply to every address on the domain
+EMAIL_DOMAIN_CACHE_TTL = int(os.getenv("EMAIL_DOMAIN_CACHE_TTL", str(6 * 3600)))
+# Resolve the domain before calling the API; off by default since a resolver outage would reject everyone
+EMAIL_DNS_CHECK = os.getenv("EMAIL_DNS_CHECK", "0") == "1"
+EMAIL_DNS_TIMEOUT = float(os.getenv("EMAIL_DNS_TIMEOUT", "1"))
+
+# Abstract reports these deliverability states; "risky" addresses are still accepted
+ACCEPTED_STATES = ("deliverable", "risky")
+# Domain cache marker for "resolves"; rejections are cached as the verdict dict itself
+DOMAIN_OK = "ok"
+
+LOCAL_PART = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*")
+DOMAIN_LABEL = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?")
+TLD = re.compile(r"(?:[A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})")
+
+
+class EmailValidationError(Exception):
+    pass
+
+
+class EmailServiceNotConfigured(EmailValidationError):
+    pass
+
+
+def normalize_email(email):
+    # Domains are case-insensitive, local parts are kept as typed
+    email = (email or "").strip()
+    local, sep, domain = email.rpartition("@")
+    if not sep:
+        return email
+    return f"{local}@{domain.lower().rstrip('.')}"
+
+
+def check_syntax(email):
+    # Cheap local check; returns a rejection reason, or None when the address may be real
+    if len(email) > 254 or email.count("@") != 1:
+        return "syntax"
+    local, domain = email.split("@")
+    if not local or len(local) > 64 or not LOCAL_PART.fullmatch(local):
+        return "syntax"
+    try:
+        domain = domain.encode("idna").decode("ascii")
+    except UnicodeError:
+        return "domain"
+    labels = domain.split(".")
+    if len(labels) < 2 or not all(DOMAIN_LABEL.fullmatch(label) for label in labels[:-1]):
+        return "domain"
+    if not TLD.fullmatch(labels[-1]):
+        return "domain"
+    return None
+
+
+def verdict(result):
+    deliverability = result.get("email_deliverability", {}) or {}
+    is_valid = bool(deliverability.get("is_format_valid", False)
+                    and deliverability.get("status") in ACCEPTED_STATES)
+    return {"valid": is_valid, "raw": result}
+
+
+class EmailValidator:
+    # Pooled, cached and coalesced front for the email reputation API
+    def __init__(self, base_url=EMAIL_VALIDATION_URL, api_key=None, session=None,
+                 timeout=(EMAIL_CONNECT_TIMEOUT, EMAIL_READ_TIMEOUT), pool_size=EMAIL_POOL_SIZE,
+                 cache_size=EMAIL_CACHE_SIZE, ttl=EMAIL_CACHE_TTL, domain_ttl=EMAIL_DOMAIN_CACHE_TTL,
+                 dns_check=EMAIL_DNS_CHECK, dns_timeout=EMAIL_DNS_TIMEOUT):
+        self.base_url = base_url
+        self._api_key = api_key
+        self.timeout = timeout
+        self.session = session or self._session(pool_size)
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.domain_cache = TTLCache(maxsize=cache_size, ttl=domain_ttl)
+        self.dns_check = dns_check
+        self.dns_timeout = dns_timeout
+        self._dns = ThreadPoolExecutor(max_workers=2, thread_name_prefix="email-dns") if dns_check else None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+
+    @staticmethod
+    def _session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def api_key(self):
+        # Read late so a key from .env (loaded after import) is picked up
+        return self._api_key or os.getenv("ABSTRACT_API_KEY")
+
+    def validate(self, email):
+        # {"valid": bool, "reason"?: str, "raw"?: dict}; raises EmailValidationError when the
+        # upstream cannot answer
+        email = normalize_email(email)
+        reason = check_syntax(email)
+        if reason is not None:
+            EMAIL_VALIDATIONS.inc(source="precheck")
+            return {"valid": False, "reason": reason}
+
+        domain = email.split("@")[1]
+        domain_state = self.domain_cache.get(domain)
+        if domain_state is None and self.dns_check:
+            domain_state = self._check_dns(domain)
+        if isinstance(domain_state, dict):
+            EMAIL_VALIDATIONS.inc(source="domain")
+            return domain_state
+
+        result = self.cache.get(email)
+        if result is not None:
+            EMAIL_VALIDATIONS.inc(source="cache")
+            return result
+
+        with self._lock:
+            future = self._inflight.get(email)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[email] = future
+
+        if not owner:
+            # Same address already being looked up (double submit, re-typed form): share it
+            EMAIL_VALIDATIONS.inc(source="coalesced")
+            try:
+                return future.result(timeout=sum(self.timeout) + 1)
+            except FutureTimeout:
+                raise EmailValidationError("Validation timed out")
+
+        try:
+            result = self._lookup(email)
+            EMAIL_VALIDATIONS.inc(source="api")
+            self.cache.set(email, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(email, None)
+
+    def _lookup(self, email):
+        if not self.api_key:
+            raise EmailServiceNotConfigured("API key missing")
+        self.lookups += 1
+        try:
+            response = self.session.get(self.base_url, params={"api_key": self.api_key, "email": email},
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise EmailValidationError(f"{type(e).__name__}: {e}") from e
+
+        checked = verdict(result)
+        # No mail server for the domain: every other address there fails the same way
+        if (result.get("email_deliverability", {}) or {}).get("is_mx_valid") is False:
+            self.domain_cache.set(email.split("@")[1], {"valid": False, "reason": "domain"})
+        return checked
+
+    def _check_dns(self, domain):
+        future = self._dns.submit(socket.getaddrinfo, domain, None)
+        try:
+            future.result(timeout=self.dns_timeout)
+        except FutureTimeout:
+            # Slow resolver: let the API decide
+            return None
+        except socket.gaierror as e:
+            # Only "no such name" is conclusive; a domain with MX but no A records is still fine
+            if e.errno == socket.EAI_NONAME:
+                rejected = {"valid": False, "reason": "domain"}
+                self.domain_cache.set(domain, rejected)
+                return rejected
+            return None
+        self.domain_cache.set(domain, DOMAIN_OK)
+        return DOMAIN_OK
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "inflight": len(self._inflight),
+            "cache": self.cache.stats(),
+            "domain_cache": self.domain_cache.stats(),
+        }
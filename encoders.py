@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+
+# Query encoder backends for rag_engine:
+#   sentence-transformers  the PyTorch model the index was built with (default)
+#   onnx                   int8-quantized ONNX export of the same model; no torch import at all
+# One-off export and equivalence check (needs torch + sentence-transformers, run on a build box):
+#   python encoders.py export --out onnx_model
+#   python encoders.py check --onnx-dir onnx_model
+ENCODER_BACKEND = os.getenv("RAG_ENCODER", "sentence-transformers")
+ONNX_DIR = os.getenv("RAG_ONNX_DIR", "onnx_model")
+# Intra-op threads per worker; several web workers share the box, so keep this small
+ONNX_THREADS = int(os.getenv("RAG_ONNX_THREADS", "1"))
+# Exported embeddings must stay this close (cosine) to the PyTorch ones for the index to remain valid
+MIN_COSINE = float(os.getenv("RAG_ONNX_MIN_COSINE", "0.99"))
+
+ENCODER_CONFIG = "encoder.json"
+BACKENDS = ("sentence-transformers", "onnx")
+
+
+class EncoderMismatch(Exception):
+    pass
+
+
+class SentenceTransformerEncoder:
+    def __init__(self, model_name):
+        # Heavy import (torch) only when this backend is actually used
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        return np.asarray(self.model.encode(texts, batch_size=batch_size, show_progress_bar=False), dtype="float32")
+
+
+class OnnxEncoder:
+    # Tokenizer (HF tokenizers, Rust) + ONNX Runtime session + the mean pooling and L2
+    # normalisation that sentence-transformers applies on top of the transformer
+    def __init__(self, model_dir=ONNX_DIR, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG), encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.model_name = self.config["model"]
+        self.max_length = self.config["max_length"]
+        self.normalize = self.config.get("normalize", True)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        pad_token = self.config.get("pad_token", "[PAD]")
+        pad_id = self.tokenizer.token_to_id(pad_token)
+        self.tokenizer.enable_padding(pad_id=pad_id if pad_id is not None else 0, pad_token=pad_token)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(os.path.join(model_dir, self.config["file"]), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _run(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype="int64"),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype="int64"),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype="int64"),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+        mask = feeds["attention_mask"][..., None].astype("float32")
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype("float32")
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        parts = [self._run(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+        return np.vstack(parts) if parts else np.zeros((0, self.config.get("dim", 0)), dtype="float32")
+
+
+def load_encoder(backend=ENCODER_BACKEND, model_name=None, onnx_dir=ONNX_DIR, threads=ONNX_THREADS):
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_name)
+    if backend == "onnx":
+        encoder = OnnxEncoder(onnx_dir, threads)
+        # Vectors from a different model would silently return nonsense neighbours
+        if model_name and encoder.model_name != model_name:
+            raise EncoderMismatch(f"ONNX export is {encoder.model_name}, the index expects {model_name}")
+        return encoder
+    raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {BACKENDS}")
+
+
+def sample_texts(count=200):
+    # What the encoder sees in production: the templated /generate queries
+    from retrieval_table import enumerate_queries
+
+    queries = enumerate_queries()
+    step = max(1, len(queries) // count)
+    return queries[::step][:count]
+
+
+def compare(reference, candidate, texts, min_cosine=MIN_COSINE, batch_size=32):
+    # Row-wise cosine between two encoders' embeddings, plus the latency of each
+    timings = {}
+    vectors = {}
+    for name, encoder in (("reference", reference), ("candidate", candidate)):
+        encoder.encode(texts[:1])  # warm-up
+        start = time.perf_counter()
+        vectors[name] = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype="float32")
+        timings[name] = round((time.perf_counter() - start) * 1000 / len(texts), 3)
+    a, b = vectors["reference"], vectors["candidate"]
+    cosine = (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(cosine.min()), 6),
+        "mean_cosine": round(float(cosine.mean()), 6),
+        "min_allowed": min_cosine,
+        "passed": bool(cosine.min() >= min_cosine),
+        "ms_per_text": timings,
+    }
+
+
+def export(model_name, out_dir, quantize=True, opset=14):
+    # Export the transformer of the sentence-transformers model, then int8-quantize its weights
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    pooling = next(m for m in st if isinstance(m, Pooling))
+    if pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"{model_name} uses {pooling.get_pooling_mode_str()} pooling, only mean is supported")
+    transformer = st[0].auto_model.eval()
+    tokenizer = st[0].tokenizer
+
+    dummy = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(dummy[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=opset)
+
+    model_file = "model.onnx"
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, os.path.join(out_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+        model_file = "model.int8.onnx"
+
+    tokenizer.save_pretrained(out_dir)
+    config = {
+        "model": model_name,
+        "file": model_file,
+        "quantized": quantize,
+        "max_length": st.max_seq_length,
+        "dim": st.get_sentence_embedding_dimension(),
+        "pooling": "mean",
+        "normalize": any(isinstance(m, Normalize) for m in st),
+        "pad_token": tokenizer.pad_token,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(out_dir, ENCODER_CONFIG), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    return config
+
+
+def main(argv=None):
+    from rag_engine import MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Export and check the ONNX query encoder")
+    parser.add_argument("command", choices=("export", "check"))
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--out", "--onnx-dir", dest="onnx_dir", default=ONNX_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="export fp32 only")
+    parser.add_argument("--threads", type=int, default=ONNX_THREADS)
+    parser.add_argument("--texts", type=int, default=200, help="sample queries for the check")
+    parser.add_argument("--min-cosine", type=float, default=MIN_COSINE)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        config = export(args.model, args.onnx_dir, quantize=not args.no_quantize)
+        print(f"Exported {config['model']} -> {os.path.join(args.onnx_dir, config['file'])}")
+
+    # Always verify: a failed check means the existing FAISS index must not be queried with this export
+    result = compare(SentenceTransformerEncoder(args.model), load_encoder("onnx", args.model, args.onnx_dir, args.threads),
+                     sample_texts(args.texts), args.min_cosine)
+    print(json.dumps(result, indent=2))
+    return 0 if result["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import time
+import numpy as np
+from artifacts import sha256_of
+from docstore import DocumentStore, write_store
+
+
+# Build (or extend) the FAISS index + document store the RAG engine serves, and describe them in
+# a manifest so rag_engine loads whichever layout was built.
+# Usage:
+#   python index_builder.py build documents.pkl --type ivfpq --out-dir build/
+#   python index_builder.py append new_docs.jsonl --out-dir build/
+MANIFEST_NAME = "index_manifest.json"
+INDEX_FILE = "faiss_index.idx"
+DOCSTORE_FILE = "documents.store"
+MANIFEST_FORMAT = 1
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+# Defaults used when the layout parameters are not given
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_NBITS = 8
+
+log = logging.getLogger(__name__)
+
+
+def load_corpus(path):
+    # documents.pkl (release format), a document store, or JSONL with one {"content": ...} per line
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return list(pickle.load(f))
+    if path.endswith(".store"):
+        store = DocumentStore(path)
+        try:
+            return list(store)
+        finally:
+            store.close()
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def doc_text(doc):
+    return doc["content"] if isinstance(doc, dict) else str(doc)
+
+
+def embed(model, documents, batch_size=64, log_every=5000):
+    # Batched encode; SentenceTransformer batches internally, the outer loop only bounds memory
+    # and gives progress output on large corpora
+    texts = [doc_text(d) for d in documents]
+    chunk = max(batch_size, (log_every // batch_size) * batch_size)
+    parts = []
+    for start in range(0, len(texts), chunk):
+        parts.append(np.asarray(model.encode(texts[start:start + chunk], batch_size=batch_size),
+                                dtype="float32"))
+        log.info("Embedded %d/%d documents", min(start + chunk, len(texts)), len(texts))
+    return np.vstack(parts) if parts else np.zeros((0, 0), dtype="float32")
+
+
+def layout(index_type, count, dim, nlist=None, pq_m=None, pq_nbits=PQ_NBITS, hnsw_m=HNSW_M):
+    # (faiss factory string, search params) for the requested layout
+    if index_type == "flat":
+        return "Flat", {}
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}", {"efSearch": HNSW_EF_SEARCH}
+    # ~4 * sqrt(n) lists, but keep ~39 training points per centroid as faiss recommends
+    nlist = nlist or max(1, min(int(4 * np.sqrt(count)), count // 39))
+    params = {"nprobe": min(IVF_NPROBE, nlist)}
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat", params
+    if index_type == "ivfpq":
+        # Sub-quantizers must divide the dimension; 8 dims per code byte by default
+        pq_m = pq_m or max(1, dim // 8)
+        if dim % pq_m:
+            raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the embedding size ({dim})")
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}", params
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+def apply_search_params(index, params):
+    # nprobe for IVF layouts, efSearch for HNSW (faiss rejects a parameter the layout does not have)
+    import faiss
+
+    if not params:
+        return index
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+    return index
+
+
+def build_index(vectors, factory, params, train_size=None, seed=0):
+    import faiss
+
+    index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_L2)
+    if factory.startswith("HNSW"):
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if train_size and len(vectors) > train_size:
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(len(vectors), train_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return apply_search_params(index, params)
+
+
+def exact_vectors(index):
+    # Stored vectors when the layout keeps them exactly (flat, IVF-flat, HNSW); None for PQ codes
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if not isinstance(faiss.downcast_index(ivf), faiss.IndexIVFFlat):
+            return None
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def recall_at_k(index, vectors, queries, k=10):
+    # Share of the exact (brute-force L2) top-k that the index returns
+    import faiss
+
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return {"k": k, "queries": len(queries), "recall": round(hits / (k * len(queries)), 4),
+            "search_ms_per_query": round(search_ms, 4)}
+
+
+def sample_queries(vectors, count, seed=0):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), min(count, len(vectors)), replace=False)
+    return vectors[np.sort(picks)]
+
+
+def corpus_digest(documents):
+    h = hashlib.sha256()
+    for doc in documents:
+        h.update(doc_text(doc).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"Unsupported index manifest format {manifest.get('format')!r} in {path}")
+    return manifest
+
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _save(index, documents, out_dir):
+    import faiss
+
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    store_path = write_store(documents, os.path.join(out_dir, DOCSTORE_FILE) + ".tmp")
+    os.replace(store_path, os.path.join(out_dir, DOCSTORE_FILE))
+    return {"index": sha256_of(index_path).hexdigest(),
+            "docstore": sha256_of(os.path.join(out_dir, DOCSTORE_FILE)).hexdigest()}
+
+
+def build(documents, model, model_name, out_dir, index_type="flat", nlist=None, pq_m=None, pq_nbits=PQ_NBITS,
+          hnsw_m=HNSW_M, batch_size=64, train_size=None, eval_queries=200, eval_k=10):
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    vectors = embed(model, documents, batch_size)
+    embed_s = time.perf_counter() - start
+
+    factory, params = layout(index_type, len(vectors), vectors.shape[1], nlist, pq_m, pq_nbits, hnsw_m)
+    start = time.perf_counter()
+    index = build_index(vectors, factory, params, train_size)
+    index_s = time.perf_counter() - start
+
+    recall = recall_at_k(index, vectors, sample_queries(vectors, eval_queries), eval_k) if eval_queries else None
+    sha256 = _save(index, documents, out_dir)
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "index_type": index_type,
+        "factory": factory,
+        "metric": "l2",
+        "dim": int(vectors.shape[1]),
+        "model": model_name,
+        "count": int(index.ntotal),
+        "search_params": params,
+        "index_file": INDEX_FILE,
+        "docstore_file": DOCSTORE_FILE,
+        "sha256": sha256,
+        "corpus_sha256": corpus_digest(documents),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "build_seconds": {"embed": round(embed_s, 2), "index": round(index_s, 2)},
+        "recall": recall,
+        "appends": [],
+    }
+    write_manifest(out_dir, manifest)
+    return manifest
+
+
+def append(documents, model, out_dir, batch_size=64, eval_queries=200, eval_k=10):
+    # New documents get the next ids; IVF layouts keep their trained centroids, so recall can drift
+    # as the corpus grows: rebuild when the appended share gets large
+    from artifacts import read_faiss_index
+
+    manifest = load_manifest(os.path.join(out_dir, MANIFEST_NAME))
+    if manifest is None:
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {out_dir}, run 'build' first")
+
+    index = read_faiss_index(os.path.join(out_dir, manifest["index_file"]), mmap=False)
+    store = DocumentStore(os.path.join(out_dir, manifest["docstore_file"]))
+    existing = list(store)
+    store.close()
+    if len(existing) != index.ntotal:
+        raise ValueError(f"Index has {index.ntotal} vectors but the store has {len(existing)} documents")
+
+    start = time.perf_counter()
+    vectors = embed(model, documents, batch_size)
+    embed_s = time.perf_counter() - start
+    if vectors.shape[1] != manifest["dim"]:
+        raise ValueError(f"Embedding size {vectors.shape[1]} does not match the index ({manifest['dim']})")
+
+    start = time.perf_counter()
+    index.add(vectors)
+    index_s = time.perf_counter() - start
+    apply_search_params(index, manifest["search_params"])
+
+    recall = None
+    stored = exact_vectors(index) if eval_queries else None
+    if stored is not None:
+        recall = recall_at_k(index, stored, sample_queries(vectors, eval_queries), eval_k)
+
+    manifest["sha256"] = _save(index, existing + documents, out_dir)
+    manifest["count"] = int(index.ntotal)
+    manifest["appends"].append({
+        "added": len(documents),
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "build_seconds": {"embed": round(embed_s, 2), "index": round(index_s, 2)},
+        "recall": recall,
+    })
+    write_manifest(out_dir, manifest)
+    return manifest
+
+
+def main(argv=None):
+    from encoders import BACKENDS, ONNX_DIR, load_encoder
+    from rag_engine import MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Build or extend the RAG FAISS index and document store")
+    parser.add_argument("command", choices=("build", "append"))
+    parser.add_argument("corpus", help="documents.pkl, a .store file or JSONL with a 'content' field")
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--type", default="flat", choices=INDEX_TYPES, help="index layout (build only)")
+    parser.add_argument("--nlist", type=int, help="IVF lists (default ~4*sqrt(n))")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers (default dim/8)")
+    parser.add_argument("--pq-nbits", type=int, default=PQ_NBITS)
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M)
+    parser.add_argument("--train-size", type=int, help="train IVF/PQ on a random sample of this size")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--backend", default="sentence-transformers", choices=BACKENDS,
+                        help="onnx embeds with the int8 export in --onnx-dir (must pass `encoders.py check`)")
+    parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    parser.add_argument("--eval-queries", type=int, default=200, help="0 skips the recall check")
+    parser.add_argument("--eval-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    documents = load_corpus(args.corpus)
+    model = load_encoder(args.backend, args.model, args.onnx_dir)
+    if args.command == "build":
+        manifest = build(documents, model, args.model, args.out_dir, args.type, args.nlist, args.pq_m,
+                         args.pq_nbits, args.hnsw_m, args.batch_size, args.train_size, args.eval_queries,
+                         args.eval_k)
+        report = manifest
+    else:
+        manifest = load_manifest(os.path.join(args.out_dir, MANIFEST_NAME))
+        if manifest is not None and manifest["model"] != args.model:
+            parser.error(f"index was built with {manifest['model']}, not {args.model}")
+        manifest = append(documents, model, args.out_dir, args.batch_size, args.eval_queries, args.eval_k)
+        report = manifest["appends"][-1]
+
+    size = os.path.getsize(os.path.join(args.out_dir, manifest["index_file"]))
+    print(f"{manifest['index_type']} ({manifest['factory']}): {manifest['count']} vectors, "
+          f"{size / 1024 / 1024:.1f} MB, build {report['build_seconds']}, recall {report['recall']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, fn, args, kwargs):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+        # Runs with the submitter's context, so its log lines keep the request's trace id
+        self.context = contextvars.copy_context()
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "error": self.error,
+            "queued_seconds": round((self.started_at or now) - self.created_at, 2),
+            "run_seconds": round((self.finished_at or now) - self.started_at, 2) if self.started_at else None,
+        }
+
+
+class JobManager:
+    # Bounded thread pool: `workers` jobs run at once, at most `max_queue` wait behind them
+    def __init__(self, workers=2, max_queue=20, retention=3600, name="report-job"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retention = retention
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn, *args, job_id=None, **kwargs):
+        # (job, created): created is False when the call joined a job already queued or running
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            # Same job already queued or running: callers share it instead of paying twice
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.state in ("queued", "running"):
+                return existing, False
+            pending = sum(1 for job in self._jobs.values() if job.state == "queued")
+            if pending >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f"{pending} report jobs already waiting")
+            job = Job(job_id, fn, args, kwargs)
+            self._jobs[job_id] = job
+            self.submitted += 1
+        self._queue.put(job)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.state = "running"
+            job.started_at = time.time()
+            try:
+                job.result = job.context.run(job.fn, *job.args, **job.kwargs)
+                job.state = "done"
+                self.completed += 1
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = "failed"
+                self.failed += 1
+                log.error("Job %s failed: %s", job.id, job.error)
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+
+    def _prune(self):
+        # Forget finished jobs after `retention` seconds (called with the lock held)
+        cutoff = time.time() - self.retention
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": states.count("queued"),
+            "running": states.count("running"),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,352 @@
+import json
+import logging
+import os
+import re
+import numpy as np
+from cache import LRUCache
+from metrics import RAG_FILTER_WIDENED
+
+
+# Attribute layer over the document store: every document is tagged with the sectors, regions,
+# frameworks and years it is about, and an inverted index maps each value to its FAISS ids so a
+# search can be restricted with a FAISS ID selector instead of spending top-k slots on other
+# industries. Built once at warm-up and cached next to the document store.
+METADATA_PATH = os.getenv("RAG_METADATA_PATH", "documents.meta.npz")
+# Restrict retrieval by the questionnaire's sector and region
+FILTERS_ENABLED = os.getenv("RAG_FILTERS", "1") == "1"
+# Fewer hits than this under the filters and the least important filter is dropped
+FILTER_MIN_HITS = int(os.getenv("RAG_FILTER_MIN_HITS", "5"))
+# Bump when the tagging rules change so cached postings are rebuilt
+METADATA_VERSION = 2
+
+FIELDS = ("sector", "region", "framework", "year")
+# Widening order: least important filter goes first
+WIDEN_ORDER = ("year", "framework", "region", "sector")
+
+# Sector-specific wording only: generic ESG text is full of "greenhouse gas", "green finance",
+# "renewable energy" and "transport emissions", which must not tag a document with a sector
+SECTOR_KEYWORDS = {
+    "energy": ["oil and gas", "oil & gas", "natural gas", "petroleum", "upstream", "refinery", "refineries",
+               "energy sector", "energy companies", "renewable energy sector", "solar farm", "wind farm",
+               "power generation", "power plant", "power plants", "utilities", "utility companies"],
+    "mining": ["mining", "mine site", "mine sites", "metals and mining", "minerals"],
+    "manufacturing": ["manufacturing", "manufacturer", "manufacturers", "factory", "factories", "automotive",
+                      "automaker", "automakers", "chemicals", "chemical industry", "steel", "cement"],
+    "construction_real_estate": ["construction sector", "construction industry", "construction companies",
+                                 "real estate", "property developers", "buildings sector"],
+    "healthcare": ["healthcare", "health care", "hospital", "hospitals", "pharmaceutical", "pharmaceuticals",
+                   "medical devices"],
+    "agriculture_food": ["agriculture", "agricultural", "agritech", "farming", "farmers", "food and beverage",
+                         "food & beverage", "food industry", "beverage", "beverages"],
+    "consumer_retail": ["retail", "retailer", "retailers", "apparel", "fashion", "textile", "textiles",
+                        "consumer goods"],
+    "technology": ["software", "telecommunications", "telecom", "data center", "data centers", "data centres",
+                   "semiconductor", "semiconductors", "technology sector", "tech companies", "ict sector"],
+    "financial": ["bank", "banks", "banking", "financial institutions", "financial services", "insurance",
+                  "insurer", "insurers", "asset managers", "asset owners"],
+    "transport_logistics": ["logistics", "shipping", "freight", "aviation", "airline", "airlines",
+                            "transportation sector", "transport sector", "trucking"],
+    "hospitality": ["hospitality", "hotel", "hotels", "tourism"],
+    "education": ["education sector", "university", "universities", "schools"],
+}
+
+REGION_KEYWORDS = {
+    "north_america": ["north america", "north american", "united states", "u.s.", "usa", "canada", "canadian"],
+    "latin_america": ["latin america", "south america", "brazil", "mexico", "chile", "argentina", "colombia",
+                      "peru"],
+    "europe": ["europe", "european", "eu", "germany", "france", "united kingdom", "uk", "italy", "spain",
+               "netherlands", "nordic", "poland"],
+    "middle_east": ["middle east", "gcc", "saudi", "ksa", "uae", "united arab emirates", "qatar", "kuwait", "oman",
+                    "bahrain", "jordan"],
+    "africa": ["africa", "african", "nigeria", "kenya", "egypt", "morocco", "ghana", "ethiopia"],
+    "asia": ["asia", "asian", "china", "japan", "india", "korea", "indonesia", "vietnam", "singapore", "thailand",
+             "malaysia", "philippines", "pakistan", "bangladesh", "kazakhstan", "uzbekistan"],
+    "oceania": ["oceania", "australia", "australian", "new zealand"],
+}
+# Questionnaire answers are short labels ("Technology", "Construction"), so they may also use the
+# broad words that are too ambiguous inside document text
+QUERY_SECTOR_KEYWORDS = {
+    "energy": ["energy", "renewable", "renewables", "oil", "gas", "solar", "wind", "utility"],
+    "manufacturing": ["industrial", "chemical"],
+    "construction_real_estate": ["construction", "property", "building", "buildings"],
+    "healthcare": ["health", "pharma", "biotech"],
+    "agriculture_food": ["food", "agri", "agribusiness"],
+    "technology": ["technology", "tech", "it", "saas"],
+    "financial": ["finance", "financial", "fintech", "investment"],
+    "transport_logistics": ["transport", "transportation", "automotive logistics"],
+    "education": ["education", "edtech"],
+}
+# A document naming more sectors or regions than this is general guidance, not specific to any
+MAX_SPECIFIC_VALUES = 2
+
+# Framework acronyms are matched case-sensitively ("gri" or "cdp" inside a word is not a framework)
+FRAMEWORK_PATTERNS = {
+    "GRI": r"\bGRI\b|Global Reporting Initiative",
+    "SASB": r"\bSASB\b",
+    "TCFD": r"\bTCFD\b|Task Force on Climate",
+    "CSRD": r"\bCSRD\b|\bESRS\b|Corporate Sustainability Reporting Directive",
+    "ISSB": r"\bISSB\b|\bIFRS S[12]\b",
+    "CDP": r"\bCDP\b|Carbon Disclosure Project",
+    "SBTi": r"\bSBTi\b|[Ss]cience[- ][Bb]ased [Tt]argets?",
+    "TNFD": r"\bTNFD\b",
+}
+
+# Publication year from the file name only: body text is full of target years (2030, 2050)
+YEAR = re.compile(r"(?<!\d)(20\d\d)(?!\d)")
+
+log = logging.getLogger(__name__)
+
+
+def _keyword_patterns(table):
+    return {value: re.compile(r"(?<![\w.])(?:" + "|".join(re.escape(k) for k in words) + r")(?![\w])", re.I)
+            for value, words in table.items()}
+
+
+PATTERNS = {
+    "sector": _keyword_patterns(SECTOR_KEYWORDS),
+    "region": _keyword_patterns(REGION_KEYWORDS),
+    "framework": {value: re.compile(pattern) for value, pattern in FRAMEWORK_PATTERNS.items()},
+}
+LABEL_PATTERNS = dict(PATTERNS, sector=_keyword_patterns(
+    {value: words + QUERY_SECTOR_KEYWORDS.get(value, []) for value, words in SECTOR_KEYWORDS.items()}))
+
+
+def extract(field, text, patterns=PATTERNS):
+    # Values of `field` mentioned in document text
+    if not text:
+        return []
+    if field == "year":
+        return sorted(set(YEAR.findall(str(text))))
+    return [value for value, pattern in patterns[field].items() if pattern.search(str(text))]
+
+
+def normalize_values(field, values):
+    # Canonical values pass through, anything else (questionnaire answers such as "Oil & Gas" or
+    # "Asia (Southeast)") goes through the keyword rules
+    if field not in FIELDS:
+        raise ValueError(f"Unknown metadata field {field!r}, expected one of {FIELDS}")
+    if isinstance(values, (str, int)):
+        values = [values]
+    canonical = set()
+    for value in values:
+        value = str(value)
+        if field != "year" and value in PATTERNS[field]:
+            canonical.add(value)
+        else:
+            canonical.update(extract(field, value, LABEL_PATTERNS))
+    return sorted(canonical)
+
+
+def normalize_filters(filters):
+    # {field: value or [values]} -> {field: [canonical values]}, fields without values dropped
+    if not filters:
+        return {}
+    normalized = {}
+    for field, values in filters.items():
+        values = normalize_values(field, values)
+        if values:
+            normalized[field] = values
+    return normalized
+
+
+def filter_key(filters):
+    # Stable cache key; "" means unfiltered
+    filters = normalize_filters(filters)
+    return json.dumps(filters, sort_keys=True, separators=(",", ":")) if filters else ""
+
+
+def query_filters(data):
+    # Filters for a questionnaire submission: the company's sector and region
+    return normalize_filters({"sector": data.get("sector_industry") or [], "region": data.get("region") or []})
+
+
+def document_attributes(doc):
+    # Explicit fields on the document win, otherwise the values are read from its text
+    text = doc.get("content", "")
+    attributes = {}
+    for field in ("sector", "region", "framework"):
+        explicit = doc.get(field)
+        if explicit:
+            attributes[field] = normalize_values(field, explicit)
+            continue
+        values = extract(field, text)
+        if field != "framework" and len(values) > MAX_SPECIFIC_VALUES:
+            values = []
+        attributes[field] = values
+    year = doc.get("year")
+    attributes["year"] = normalize_values("year", year) if year else extract("year", doc.get("source", ""))
+    return attributes
+
+
+def widening(filters):
+    # The filters to try in order: all of them, then dropping one field at a time, then none
+    levels = [dict(filters)]
+    current = dict(filters)
+    for field in WIDEN_ORDER:
+        if field in current:
+            current = {k: v for k, v in current.items() if k != field}
+            levels.append(current)
+    if levels[-1]:
+        levels.append({})
+    return levels
+
+
+class MetadataIndex:
+    def __init__(self, postings, count, corpus=None, selector_cache_size=256):
+        # postings: {(field, value): sorted int64 FAISS ids}; corpus: SHA-256 of the docstore tagged
+        self.postings = postings
+        self.count = count
+        self.corpus = corpus
+        self._tagged = {}
+        for field in FIELDS:
+            mask = np.zeros(count, dtype=bool)
+            for (f, _), ids in postings.items():
+                if f == field:
+                    mask[ids] = True
+            self._tagged[field] = mask
+        self._selectors = LRUCache(selector_cache_size)
+
+    @classmethod
+    def build(cls, documents, corpus=None):
+        lists = {}
+        for doc_id, doc in enumerate(documents):
+            for field, values in document_attributes(doc).items():
+                for value in values:
+                    lists.setdefault((field, value), []).append(doc_id)
+        postings = {key: np.array(ids, dtype=np.int64) for key, ids in lists.items()}
+        return cls(postings, len(documents), corpus)
+
+    def save(self, path):
+        arrays = {f"{field}/{value}": ids for (field, value), ids in self.postings.items()}
+        arrays["__header__"] = np.array([METADATA_VERSION, self.count], dtype=np.int64)
+        arrays["__corpus__"] = np.array(self.corpus or "")
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, count=None, corpus=None):
+        # None when the file is missing, from older tagging rules, or tagged from another corpus
+        # (a rebuilt docstore of the same size included)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            version, stored_count = data["__header__"].tolist()
+            if version != METADATA_VERSION or (count is not None and stored_count != count):
+                return None
+            stored_corpus = str(data["__corpus__"]) or None
+            if corpus is not None and stored_corpus != corpus:
+                return None
+            postings = {}
+            for name in data.files:
+                if name not in ("__header__", "__corpus__"):
+                    field, value = name.split("/", 1)
+                    postings[(field, value)] = data[name]
+        return cls(postings, stored_count, stored_corpus)
+
+    @classmethod
+    def load_or_build(cls, path, documents, corpus=None):
+        index = cls.load(path, len(documents), corpus)
+        if index is None:
+            index = cls.build(documents, corpus)
+            index.save(path)
+            log.info("Tagged %d documents with %d attribute values -> %s", index.count, len(index.postings), path)
+        return index
+
+    def values(self, field):
+        return sorted(value for f, value in self.postings if f == field)
+
+    def mask(self, filters):
+        # Documents tagged with a requested value, or not tagged for that field at all (general
+        # guidance applies to every sector); fields are combined with AND
+        allowed = np.ones(self.count, dtype=bool)
+        for field, values in normalize_filters(filters).items():
+            matches = ~self._tagged[field]
+            for value in values:
+                ids = self.postings.get((field, value))
+                if ids is not None:
+                    matches[ids] = True
+            allowed &= matches
+        return allowed
+
+    def selector(self, filters):
+        # (faiss IDSelectorBitmap, allowed count); the bitmap array is kept alive with the selector
+        import faiss
+
+        key = filter_key(filters)
+        cached = self._selectors.get(key)
+        if cached is None:
+            mask = self.mask(filters)
+            bits = np.packbits(mask, bitorder="little")
+            cached = (faiss.IDSelectorBitmap(self.count, faiss.swig_ptr(bits)), int(mask.sum()), bits)
+            self._selectors.set(key, cached)
+        return cached[0], cached[1]
+
+    def stats(self):
+        return {
+            "documents": self.count,
+            "values": {field: len(self.values(field)) for field in FIELDS},
+            "tagged": {field: int(self._tagged[field].sum()) for field in FIELDS},
+            "selectors": self._selectors.stats(),
+        }
+
+
+def search_parameters(index, selector):
+    # The layout's own nprobe / efSearch must be carried over, SearchParameters defaults would replace them
+    import faiss
+
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def filtered_search(index, metadata, vectors, top_k, filters, min_hits=FILTER_MIN_HITS):
+    # Search restricted by `filters`, widening them per query while fewer than min_hits come back.
+    # Returns [(ids, distances)] sorted by distance like index.search, at most top_k each.
+    min_hits = min(min_hits, top_k)
+    filters = normalize_filters(filters)
+    if filters:
+        selector, allowed = metadata.selector(filters)
+        if 0 < allowed < metadata.count:
+            D, I = index.search(vectors, top_k, params=search_parameters(index, selector))
+            # Common case: the filters leave enough documents, nothing to widen or merge
+            if ((I >= 0).sum(axis=1) >= min_hits).all():
+                return [(I[row][I[row] >= 0], D[row][I[row] >= 0]) for row in range(len(vectors))]
+
+    found = [dict() for _ in range(len(vectors))]
+    pending = list(range(len(vectors)))
+    levels = widening(filters)
+    for step, level in enumerate(levels):
+        if level:
+            selector, allowed = metadata.selector(level)
+            if allowed == 0:
+                continue
+        if level and allowed < metadata.count:
+            D, I = index.search(vectors[pending], top_k, params=search_parameters(index, selector))
+        else:
+            D, I = index.search(vectors[pending], top_k)
+        for row, pos in enumerate(pending):
+            for doc_id, distance in zip(I[row], D[row]):
+                if doc_id >= 0:
+                    found[pos].setdefault(int(doc_id), float(distance))
+        pending = [pos for pos in pending if len(found[pos]) < min_hits]
+        if not pending:
+            break
+        if step + 1 < len(levels):
+            RAG_FILTER_WIDENED.inc(len(pending))
+
+    import faiss
+
+    results = []
+    # Best first, like index.search: largest similarity for inner product, smallest distance otherwise
+    descending = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    for hits in found:
+        # Hits from stricter levels come first and are kept; wider levels only fill the remaining slots
+        ranked = sorted(list(hits.items())[:top_k], key=lambda item: item[1], reverse=descending)
+        results.append((np.array([i for i, _ in ranked], dtype=np.int64),
+                        np.array([d for _, d in ranked], dtype=np.float32)))
+    return results
@@ -0,0 +1,224 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, wide enough for multi-minute Gemini calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180)
+# Size buckets for characters / tokens
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self, name=None):
+        name = name or self.name
+        return [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        # Text format 0.0.4: HELP/TYPE and the samples share one name, which carries the _total suffix
+        name = f"{self.name}_total"
+        lines = self.header(name)
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = [("le", _number(bound) if bound == float("inf") else f"{bound:g}")]
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    # Metrics plus collectors: callables returning [(name, kind, help, [(labels dict, value)])],
+    # used to export numbers the caches and pools already keep in their stats()
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                # A broken collector must not take the whole endpoint down
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {_escape(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                if kind == "counter":
+                    name = f"{name}_total"
+                lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"])
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------- hot-path metrics ----------
+RAG_ENCODE_SECONDS = REGISTRY.histogram("rag_encode_seconds", "Query embedding time per encode call")
+RAG_SEARCH_SECONDS = REGISTRY.histogram("rag_search_seconds", "FAISS search time per search call")
+RAG_BATCH_SIZE = REGISTRY.histogram("rag_batch_queries", "Queries per encode + search call",
+                                    buckets=(1, 2, 4, 8, 16, 32, 64))
+RAG_SIDECAR_SECONDS = REGISTRY.histogram("rag_sidecar_seconds", "Round trip to the retrieval sidecar", ["op"])
+RAG_FILTER_WIDENED = REGISTRY.counter("rag_filter_widened", "Filtered queries widened for too few hits, per step")
+CONTEXT_CHARS = REGISTRY.histogram("rag_context_chars", "Characters of RAG context put in the prompt",
+                                   buckets=SIZE_BUCKETS)
+PROMPT_CHARS = REGISTRY.histogram("llm_prompt_chars", "Prompt size in characters", ["mode"], buckets=SIZE_BUCKETS)
+LLM_SECONDS = REGISTRY.histogram("llm_request_seconds", "Gemini generate_content latency", ["mode"])
+LLM_FIRST_CHUNK_SECONDS = REGISTRY.histogram("llm_first_chunk_seconds", "Time to the first streamed chunk")
+LLM_TOKENS = REGISTRY.histogram("llm_tokens", "Gemini token usage per request", ["mode", "kind"],
+                                buckets=SIZE_BUCKETS)
+HTML_CLEANUP_SECONDS = REGISTRY.histogram("html_cleanup_seconds", "Fence stripping and heading cleanup", ["step"])
+PDF_RENDER_SECONDS = REGISTRY.histogram("pdf_render_seconds", "xhtml2pdf HTML to PDF time", ["mode"])
+PDF_COMPOSITE_SECONDS = REGISTRY.histogram("pdf_composite_seconds", "Template overlay and merge time")
+PDF_PAGES = REGISTRY.histogram("pdf_pages", "Report pages before the cover and appendix",
+                               buckets=(5, 10, 20, 30, 40, 60, 80, 120))
+EMAIL_VALIDATION_SECONDS = REGISTRY.histogram("email_validation_seconds", "Email validation latency", ["result"])
+EMAIL_VALIDATIONS = REGISTRY.counter("email_validations", "Email validations by where the answer came from",
+                                     ["source"])
+REPORTS = REGISTRY.counter("reports", "Report requests by outcome", ["outcome"])
+ERRORS = REGISTRY.counter("errors", "Errors by pipeline stage", ["stage"])
+HTTP_SECONDS = REGISTRY.histogram("http_request_seconds", "Request latency by endpoint", ["endpoint", "method"])
+HTTP_REQUESTS = REGISTRY.counter("http_requests", "Requests by endpoint and status", ["endpoint", "method", "status"])
+
+
+def usage_tokens(response):
+    # (prompt tokens, output tokens) from a Gemini response, None when the SDK does not report usage
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    prompt = getattr(usage, "prompt_token_count", None)
+    output = getattr(usage, "candidates_token_count", None)
+    if prompt is None and output is None:
+        return None
+    return prompt or 0, output or 0
+
+
+def observe_usage(response, mode):
+    tokens = usage_tokens(response)
+    if tokens is not None:
+        LLM_TOKENS.observe(tokens[0], mode=mode, kind="prompt")
+        LLM_TOKENS.observe(tokens[1], mode=mode, kind="output")
+    # Prompt tokens served from cached content (explicit or implicit prefix caching)
+    cached = getattr(getattr(response, "usage_metadata", None), "cached_content_token_count", None)
+    if cached:
+        LLM_TOKENS.observe(cached, mode=mode, kind="cached")
+
+
+def cache_family(name, stats_by_cache):
+    # Counter families from {cache label: stats dict with hits/misses/evictions}
+    families = []
+    for field in ("hits", "misses", "evictions"):
+        samples = [({"cache": label}, stats[field]) for label, stats in stats_by_cache.items() if field in stats]
+        if samples:
+            families.append((f"{name}_{field}", "counter", f"Cache {field}", samples))
+    return families
@@ -0,0 +1,60 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    # Collects concurrent single-item calls for a few milliseconds and runs them as one batch.
+    # batch_fn takes a list of items and returns a list of results in the same order.
+    def __init__(self, batch_fn, max_batch=32, max_wait_ms=5, name="microbatch"):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            # Linger briefly so concurrent callers can join this batch
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while len(pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    pending.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                pass
+
+            items = [item for item, _ in pending]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
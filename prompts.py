@@ -0,0 +1,387 @@
+import hashlib
+import inspect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import timedelta
+
+
+# Report prompt templates. The static part (persona, method, HTML rules, section scaffold) is
+# sent once as the model's system instruction, or as Gemini cached content where available;
+# each request only carries the retrieved context and the company's answers, rendered from
+# FIELD_SCHEMA. The prompt version is a hash of the rendered templates, so editing any of them
+# invalidates cached reports without a manual bump. sections.py builds the per-section prompts
+# (REPORT_MODE=sections) on the same pieces.
+#   python prompts.py    # print the versions and check FIELD_SCHEMA against static/chatbot.js
+PROMPT_REVISION = "2025.2"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Explicit context caching of the system instruction. Needs a model version that supports it
+# and a prefix above the model's minimum cache size, so it is opt-in; without it, Gemini's
+# implicit prefix caching still applies since the static part always comes first.
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "0") == "1"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+
+CHATBOT_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "chatbot.js")
+
+log = logging.getLogger(__name__)
+
+
+class Field:
+    def __init__(self, name, label=None):
+        self.name = name
+        self.label = label
+
+
+class FieldGroup:
+    def __init__(self, title, fields, style="diagnostic"):
+        self.title = title
+        self.fields = fields
+        self.style = style
+
+
+# Everything the prompt reads from a submission, in prompt order
+FIELD_SCHEMA = [
+    FieldGroup("Company Profile", [
+        Field("company_name", "Company Name"),
+        Field("region", "Region"),
+        Field("major_countries", "Countries of Operation"),
+        Field("sector_industry", "Sector & Industry"),
+        Field("company_size", "Company Size"),
+        Field("listing_status", "Listing Status"),
+        Field("total_emissions", "Total GHG Emissions"),
+    ], style="profile"),
+    FieldGroup("Maturity Score", [
+        Field("score_total", "Total Score"),
+        Field("score_level", "Level"),
+        Field("score_level_name", "Level Name"),
+        Field("confidence", "Confidence"),
+    ], style="profile"),
+    FieldGroup("Strategy & Governance", [Field(name) for name in (
+        "sustainability_strategy", "governance_accountability", "materiality_assessment", "erm_esg",
+        "incentives_performance", "framework_alignment")]),
+    FieldGroup("Policy & Compliance", [Field("policies_monitoring")]),
+    FieldGroup("Climate (Focus Area)", [Field(name) for name in (
+        "netzero_targets", "scope_coverage", "climate_disclosure", "decarbonization_plan", "carbon_pricing",
+        "transition_plan")]),
+    FieldGroup("Energy, Resources & Circularity", [Field(name) for name in (
+        "energy_management", "renewables_adoption", "electrification_energy", "waste_management",
+        "waste_diverted", "product_sustainability", "biodiversity_nature", "green_buildings")]),
+    FieldGroup("Water Stewardship", [Field(name) for name in (
+        "water_measurement", "nature_based_solutions", "water_risk", "water_efficiency")]),
+    FieldGroup("Supply Chain & Procurement", [Field(name) for name in (
+        "supplier_esg", "purchased_goods", "sustainable_procurement")]),
+    FieldGroup("People, Culture & Training", [Field("esg_training"), Field("staff_green")]),
+    FieldGroup("Data, Systems & Reporting", [Field("data_systems"), Field("reporting_quality")]),
+    FieldGroup("External Signals", [Field("ratings_certifications"), Field("green_finance")]),
+]
+# Contact details the chatbot collects for the lead form; they never go to the model
+CONTACT_FIELDS = {"email", "Name", "Phone_number"}
+
+PERSONA = """AI Persona & Role Definition
+You are a top-tier sustainability and ESG (Environmental, Social, and Governance) consultant with 30 years of global experience. Your clientele includes multinational corporations across sectors like manufacturing, technology, and consumer goods. You are an expert in key reporting frameworks including the Global Reporting Initiative (GRI), Sustainability Accounting Standards Board (SASB), and the Task Force on Climate-related Financial Disclosures (TCFD), and you have deep knowledge of emerging regulations like the EU's Corporate Sustainability Reporting Directive (CSRD).
+Your signature approach is to move beyond mere data reporting. You perform a strategic gap analysis, benchmarking a company's current state against industry best practices, regulatory expectations, and market leadership standards to produce a clear, actionable roadmap."""
+
+RAG_HEADER = """[CONTEXT FROM KNOWLEDGE BASE / RAG RESULTS]
+The following documents have been retrieved from the knowledge base to provide industry benchmarks, regulations, and best practices. Use this information strictly as reference material when analyzing and creating the report:"""
+
+REPORT_INSTRUCTION = PERSONA + """
+Core Task & Objective
+Your primary task is to analyze the provided company sustainability data and generate a comprehensive, board-ready sustainability report in a single HTML file. The report must not only present the data but also provide expert observations and strategic recommendations for each section. The final output will serve as both a current-state assessment and a forward-looking strategic plan, including a detailed 5-year roadmap and specific KPIs.
+Each request contains [CONTEXT FROM KNOWLEDGE BASE / RAG RESULTS], the retrieved reference material, followed by [COMPANY PROFILE & DIAGNOSTIC DATA], the company's answers and the date of the report.
+Detailed Instructions for Report Generation
+1. Analytical Approach (Apply this to every section):
+For each topic (e.g., Governance, Climate, Water), you must follow a three-part structure:
+•    Current Status (Observation): Synthesize the relevant input data points into a clear narrative. State what the company is currently doing or where information is lacking.
+•    Expert Analysis & Gap Identification: Analyze the current status. Benchmark it against what leading companies in the industry are doing and what frameworks like TCFD or CSRD require. Clearly state the strategic gaps, risks, or missed opportunities. For example, if materiality_assessment is 'N/A', state: "The absence of a formal materiality assessment exposes the company to risks of focusing on non-critical ESG issues and failing to meet stakeholder expectations and upcoming regulatory requirements for disclosure."
+•    Actionable Recommendations: Provide specific, concrete recommendations to close the identified gaps. Recommendations should be practical and prioritize actions that have the highest impact.
+2. Report Structure and Content Mapping:
+Generate the report using the exact section and subsection numbering and titles provided below. Use the input data as the basis for your analysis in the corresponding sections.
+3. Roadmap and KPI Specificity:
+•    The Five-Year Roadmap must be a direct consequence of the recommendations made throughout the report. Each year's initiatives should logically build upon the previous one.
+•    The KPIs & Targets section must propose specific, measurable, achievable, relevant, and time-bound (SMART) goals. Instead of a generic "Reduce Waste," propose a target like "Reduce non-hazardous waste to landfill by 25% from a 2025 baseline by 2028."
+4. HTML Formatting & Style:
+•    Strictly adhere to the specified HTML structure: <h2> for main section headings, <h3> for subheadings, and <p>, <ul>, <li>, <div> for content.
+•    Do NOT add a main title like "Sustainability Report," as this is handled by the application.
+•    Ensure readability and professional presentation. Use inline CSS to style tables, lists, and headers for a clean, modern look. The final document must be well-organized and easily convertible to a PDF. Use a professional font-family like 'Inter', 'Helvetica', or 'Arial'.
+•    Every <h2> section heading must start on a new page when converted to PDF. Apply inline style: <h2 style="page-break-before: always;"> except for the very first <h2>.
+•    For tables: wrap them in <div style="page-break-inside: avoid;"> and use <table style="page-break-inside: avoid; width:100%; border-collapse: collapse;"> to ensure they fit on a single page without breaking.
+
+[AI OUTPUT REQUIRED] - HTML Report Structure
+IMPORTANT: Always generate all 14 sections in sequence, numbered exactly from 1 to 14.
+Do not skip or stop early, even if input data is missing.
+If data is missing, write "Data not available" but still generate the full section.
+1. Company Profile
+(Use the Company Profile data points and the Date of Report to build the profile in a structured format with bullet points or a table.)
+At the bottom of this section, always include the following disclaimer in italic style:
+"This report is generated automatically using AI and provided data. Please review and verify the accuracy of the content before publishing or making business decisions."
+
+2. Maturity Level
+Use the Maturity Score values (Total Score, Level, Level Name, Confidence) to describe the maturity level of the company.
+Explain what this maturity level means for the company in terms of sustainability journey.
+
+3. Executive Summary
+a. Purpose of the Report
+(State the report's goal: to provide a comprehensive assessment of the company's current ESG maturity and a strategic roadmap for improvement.)
+b. Findings based on AI diagnostic
+(Summarize the most critical findings from your analysis, highlighting 3-4 key strengths and 3-4 major areas for development.)
+c. Recommendations
+(List the top 3-5 most impactful, high-priority recommendations that will drive the sustainability strategy forward.)
+
+4. Governance & Strategy
+(Analyze data points: sustainability_strategy, governance_accountability, materiality_assessment, erm_esg, incentives_performance, framework_alignment, policies_monitoring.)
+
+5. Climate Strategy & Transition Plan
+a. Greenhouse Gas (GHG) Inventory
+(Analyze scope_coverage.)
+b. Targets & SBTi Pathway
+(Analyze netzero_targets.)
+c. Decarbonization Levers & Capex Plan
+(Analyze decarbonization_plan and carbon_pricing.)
+d. Climate Risk & Resilience
+(Analyze transition_plan.)
+e. Disclosure
+(Analyze climate_disclosure.)
+
+6. Energy, Resources & Circularity
+a. Energy management
+(Analyze energy_management.)
+b. Renewables
+(Analyze renewables_adoption.)
+c. Electrification & decentralized energy
+(Analyze electrification_energy.)
+d. Waste
+(Analyze waste_management and waste_diverted.)
+e. Product/service sustainability
+(Analyze product_sustainability.)
+f. Biodiversity & nature
+(Analyze biodiversity_nature.)
+g. Green buildings
+(Analyze green_buildings.)
+
+7. Water Stewardship
+a. Measurement
+(Analyze water_measurement.)
+b. Basin stress mapping
+(Analyze water_risk.)
+c. Efficiency & reuse
+(Analyze water_efficiency.)
+d. Nature-based solutions
+(Analyze nature_based_solutions.)
+
+8. Supply Chain & Procurement
+a. Supplier ESG expectations
+(Analyze supplier_esg.)
+b. Scope 3 - purchased goods/services
+(Analyze purchased_goods.)
+c. Sustainable procurement
+(Analyze sustainable_procurement.)
+
+9. People, Culture & Training
+a. Training curriculum
+(Analyze esg_training.)
+b. Employee engagement
+(Analyze staff_green.)
+c. DEI & community
+(Expand on the importance of social metrics, even if not explicitly in the data, as a key part of a holistic strategy.)
+
+10. Data, Systems & Reporting
+a. Systems
+(Analyze data_systems.)
+b. Controls
+(Recommend data verification and assurance processes.)
+c. Reporting
+(Analyze reporting_quality and framework_alignment.)
+
+11. External Signals & Green Finance
+a. Ratings/certifications
+(Analyze ratings_certifications.)
+b. Green finance readiness
+(Analyze green_finance.)
+
+12. Five-Year Roadmap (2026-2030)
+(Create a table or structured list for the roadmap, ensuring each year's initiatives are derived from your recommendations.)
+a. 2026 — Planning & Foundation
+b. 2027 — Measurement & Reduction
+c. 2028 — Circularity & Engagement
+d. 2029 — Certification & Reporting
+e. 2030 — Science-Based Targets & Innovation
+
+13. KPIs & Targets
+(Propose specific, SMART targets in a table format for each category.)
+a. GHG: S1+S2
+b. Energy
+c. Water
+d. Waste
+e. People
+f. Supply chain
+g. Data/assurance
+
+14. Dependencies, Risks & Mitigations
+(Outline potential challenges to implementing the roadmap in a   structured list.)
+a. Data availability
+b. Budget/capex
+c. Change management
+
+IMPORTANT: Always generate all 14 sections in sequence, numbered exactly from 1 to 14.
+Do not skip or stop early, even if input data is missing.
+If data is missing, write "Data not available" but still generate the full section."""
+
+
+def field_value(data, field):
+    # Checkbox answers arrive as lists, button answers as strings
+    value = data.get(field)
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value) or "None"
+    if value is None or value == "":
+        return "N/A"
+    return str(value)
+
+
+def render_data(data, report_date):
+    lines = ["[COMPANY PROFILE & DIAGNOSTIC DATA]"]
+    for group in FIELD_SCHEMA:
+        lines.append(f"{group.title}:")
+        for field in group.fields:
+            if group.style == "profile":
+                lines.append(f'•    {field.label}: "{field_value(data, field.name)}"')
+            else:
+                lines.append(f'o    {field.name}: "{field_value(data, field.name)}"')
+        if group.title == "Company Profile":
+            lines.append(f'•    Date of Report: "{report_date}"')
+    return "\n".join(lines)
+
+
+def build_user_prompt(data, rag_context, report_date):
+    # The per-request part: retrieved context and the company's answers
+    return "\n".join([
+        RAG_HEADER,
+        rag_context,
+        render_data(data, report_date),
+        "Generate the complete HTML report now: all 14 sections, as specified in your instructions.",
+    ])
+
+
+def build_prompt(data, rag_context, report_date):
+    # One self-contained prompt (instruction first), for models called without a system instruction
+    return REPORT_INSTRUCTION + "\n\n" + build_user_prompt(data, rag_context, report_date)
+
+
+def schema_fields():
+    return [field.name for group in FIELD_SCHEMA for field in group.fields]
+
+
+def prompt_version(*parts):
+    digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+    return f"{PROMPT_REVISION}+{digest[:12]}"
+
+
+def _template_text():
+    # The user prompt with every value replaced by its field name: changes whenever the layout does
+    placeholders = {name: "{" + name + "}" for name in schema_fields()}
+    return build_user_prompt(placeholders, "{rag_context}", "{report_date}")
+
+
+PROMPT_VERSION = prompt_version(REPORT_INSTRUCTION, _template_text())
+
+
+# ---------- schema vs chatbot.js ----------
+ASK_BUTTONS = re.compile(r'askButtons\(\s*"(?:[^"\\]|\\.)*",\s*\[(.*?)\],\s*"(\w+)"(.*?)\);', re.DOTALL)
+ASK_INPUT = re.compile(r'askInput\(\s*"(?:[^"\\]|\\.)*",\s*"(\w+)"', re.DOTALL)
+OPTION_VALUE = re.compile(r'value:\s*"((?:[^"\\]|\\.)*)"')
+# Fields calculateScore() adds to the payload
+DATA_ASSIGN = re.compile(r'data\["(\w+)"\]\s*=')
+
+
+def questionnaire_fields(js_path=CHATBOT_JS):
+    # [(field, options or None, scored)] in the order the chatbot asks them
+    with open(js_path, encoding="utf-8") as f:
+        source = f.read()
+    found = []
+    for m in ASK_BUTTONS.finditer(source):
+        found.append((m.start(), m.group(2), OPTION_VALUE.findall(m.group(1)), "score: false" not in m.group(3)))
+    for m in ASK_INPUT.finditer(source):
+        found.append((m.start(), m.group(1), None, False))
+    return [(field, options, scored) for _, field, options, scored in sorted(found)]
+
+
+def check_schema(js_path=CHATBOT_JS):
+    # (sent by the chatbot but not in the prompt, in the prompt but never sent)
+    with open(js_path, encoding="utf-8") as f:
+        derived = DATA_ASSIGN.findall(f.read())
+    sent = {field for field, _, _ in questionnaire_fields(js_path)} | set(derived)
+    expected = set(schema_fields())
+    return sorted(sent - expected - CONTACT_FIELDS), sorted(expected - sent)
+
+
+# ---------- model ----------
+def _supports_system_instruction(genai):
+    return "system_instruction" in inspect.signature(genai.GenerativeModel.__init__).parameters
+
+
+class InstructedModel:
+    # generate_content() with a fixed system instruction. Depending on the SDK that is a native
+    # system instruction, explicit cached content (PROMPT_CACHE=1), or, on old SDKs, a prefix
+    # on every prompt.
+    def __init__(self, system_instruction, model_name=GEMINI_MODEL, cache=PROMPT_CACHE, cache_ttl=PROMPT_CACHE_TTL):
+        import google.generativeai as genai
+
+        self.genai = genai
+        self.system_instruction = system_instruction
+        self.model_name = model_name
+        self.native = _supports_system_instruction(genai)
+        if self.native:
+            self.model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        else:
+            self.model = genai.GenerativeModel(model_name)
+        self.cache = cache and self.native
+        self.cache_ttl = cache_ttl
+        self._cached_model = None
+        self._cache_expires = 0.0
+        self._lock = threading.Lock()
+
+    def _cached(self):
+        # Model bound to a live CachedContent, recreated shortly before it expires;
+        # None when caching is off or the API refused (e.g. prefix below the minimum size)
+        if not self.cache:
+            return None
+        with self._lock:
+            if self._cached_model is not None and time.monotonic() < self._cache_expires:
+                return self._cached_model
+            try:
+                from google.generativeai import caching
+
+                # Named after this instruction's own text: section and report models cache different ones
+                content = caching.CachedContent.create(
+                    model=self.model_name, display_name=f"instruction-{prompt_version(self.system_instruction)}",
+                    system_instruction=self.system_instruction, ttl=timedelta(seconds=self.cache_ttl))
+                self._cached_model = self.genai.GenerativeModel.from_cached_content(content)
+                self._cache_expires = time.monotonic() + self.cache_ttl * 0.9
+                log.info("Cached the system instruction as %s", content.name)
+            except Exception as e:
+                log.warning("Context caching unavailable for %s, using the plain system instruction: %s",
+                            self.model_name, e)
+                self.cache = False
+                self._cached_model = None
+            return self._cached_model
+
+    def generate_content(self, contents, **kwargs):
+        if not self.native:
+            contents = self.system_instruction + "\n\n" + contents
+        model = self._cached() or self.model
+        return model.generate_content(contents, **kwargs)
+
+
+if __name__ == "__main__":
+    from sections import SECTION_PROMPT_VERSION
+
+    print(f"report prompt:   {PROMPT_VERSION}")
+    print(f"section prompts: {SECTION_PROMPT_VERSION}")
+    unknown, missing = check_schema()
+    if unknown:
+        print(f"Sent by chatbot.js but not in FIELD_SCHEMA: {', '.join(unknown)}")
+    if missing:
+        print(f"In FIELD_SCHEMA but never sent by chatbot.js: {', '.join(missing)}")
+    sys.exit(1 if unknown or missing else 0)
@@ -1,63 +1,449 @@
-import faiss
-import pickle
+import logging
 import numpy as np
-import requests
 import os
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+from urllib.parse import urljoin
+from artifacts import ArtifactError, ArtifactManager, RELEASE_BASE_URL, read_faiss_index
+from docstore import DocumentStore, convert_pickle, record_digest, store_digest
+from encoders import ENCODER_BACKEND, ONNX_DIR, load_encoder
+from index_builder import MANIFEST_NAME, apply_search_params, load_manifest
+from metadata_index import FILTER_MIN_HITS, METADATA_PATH, MetadataIndex, filter_key, filtered_search
+from cache import LRUCache
+from metrics import RAG_BATCH_SIZE, RAG_ENCODE_SECONDS, RAG_SEARCH_SECONDS
+from microbatch import MicroBatcher
+from retrieval_table import TABLE_PATH, build_query, load_table, normalize_query
 
 
 # GitHub release file URLs
-DOCS_URL = "https://github.com/RajaMuhammadHammad/Ed-Watch-AI/releases/download/v1.0.0/documents.pkl"
-FAISS_URL = "https://github.com/RajaMuhammadHammad/Ed-Watch-AI/releases/download/v1.0.0/faiss_index.idx"
+DOCS_URL = f"{RELEASE_BASE_URL}/documents.pkl"
+FAISS_URL = f"{RELEASE_BASE_URL}/faiss_index.idx"
+
+# Pinned SHA-256 of the release files (verification is skipped when unset)
+DOCS_SHA256 = os.getenv("RAG_DOCS_SHA256")
+FAISS_SHA256 = os.getenv("RAG_FAISS_SHA256")
 
 # Local cache paths (Render ephemeral filesystem, re-downloaded each time container restarts)
 DOCS_PATH = "documents.pkl"
 FAISS_PATH = "faiss_index.idx"
+DOCSTORE_PATH = "documents.store"
+
+# Optional prebuilt document store (python docstore.py documents.pkl documents.store prints the
+# hash to pin). Without one, documents.pkl is downloaded and converted once per boot. When a store
+# is configured but cannot be fetched, RAG_DOCSTORE_FROM_PICKLE=1 falls back to the conversion.
+DOCSTORE_URL = os.getenv("RAG_DOCSTORE_URL")
+DOCSTORE_SHA256 = os.getenv("RAG_DOCSTORE_SHA256")
+DOCSTORE_FROM_PICKLE = os.getenv("RAG_DOCSTORE_FROM_PICKLE", "0") == "1"
+
+# Same embedding model used during index creation
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Index built with index_builder.py: the manifest names the layout, files, model and search
+# parameters. Without one, the flat release index above is used.
+MANIFEST_PATH = os.getenv("RAG_MANIFEST_PATH", MANIFEST_NAME)
+# Optional remote manifest; its index and docstore are fetched from the same base URL
+MANIFEST_URL = os.getenv("RAG_MANIFEST_URL")
+
+# How long a retrieval call waits for warm-up before giving up (seconds)
+READY_TIMEOUT = float(os.getenv("RAG_READY_TIMEOUT", "60"))
+
+# Fallback cache for queries that are not in the precomputed table
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+
+# Micro-batching of concurrent single-query calls (0 disables it)
+MICROBATCH_WAIT_MS = float(os.getenv("RAG_MICROBATCH_WAIT_MS", "0"))
+MICROBATCH_MAX = int(os.getenv("RAG_MICROBATCH_MAX", "32"))
+
+# Open the FAISS index memory-mapped so workers share the page cache
+FAISS_MMAP = os.getenv("RAG_FAISS_MMAP", "1") == "1"
+
+log = logging.getLogger(__name__)
+
+
+class EngineNotReady(Exception):
+    pass
+
+
+artifacts = ArtifactManager()
+
+
+def download_file(url, filepath, sha256=None):
+    return artifacts.ensure(url, filepath, sha256)
+
+
+class RAGEngine:
+    # Stages reported by /healthz while the engine warms up
+    STAGES = ["idle", "downloading", "loading_index", "loading_documents", "loading_metadata", "loading_model",
+              "loading_table", "ready"]
+
+    def __init__(self, docs_url=DOCS_URL, faiss_url=FAISS_URL,
+                 docs_path=DOCS_PATH, faiss_path=FAISS_PATH, model_name=MODEL_NAME,
+                 docs_sha256=DOCS_SHA256, faiss_sha256=FAISS_SHA256, mmap=FAISS_MMAP,
+                 docstore_path=DOCSTORE_PATH, docstore_url=DOCSTORE_URL, docstore_sha256=DOCSTORE_SHA256,
+                 docstore_from_pickle=DOCSTORE_FROM_PICKLE,
+                 table_path=TABLE_PATH, query_cache_size=QUERY_CACHE_SIZE,
+                 microbatch_wait_ms=MICROBATCH_WAIT_MS, microbatch_max=MICROBATCH_MAX,
+                 manifest_path=MANIFEST_PATH, manifest_url=MANIFEST_URL,
+                 encoder_backend=ENCODER_BACKEND, onnx_dir=ONNX_DIR, metadata_path=METADATA_PATH,
+                 filter_min_hits=FILTER_MIN_HITS):
+        self.docs_url = docs_url
+        self.faiss_url = faiss_url
+        self.docs_path = docs_path
+        self.faiss_path = faiss_path
+        self.model_name = model_name
+        self.docs_sha256 = docs_sha256
+        self.faiss_sha256 = faiss_sha256
+        self.mmap = mmap
+        self.docstore_path = docstore_path
+        self.docstore_url = docstore_url
+        self.docstore_sha256 = docstore_sha256
+        self.docstore_from_pickle = docstore_from_pickle
+        self.table_path = table_path
+        self.manifest_path = manifest_path
+        self.manifest_url = manifest_url
+        self.manifest = None
+        self.encoder_backend = encoder_backend
+        self.onnx_dir = onnx_dir
+        self.metadata_path = metadata_path
+        self.filter_min_hits = filter_min_hits
+
+        self.faiss_index = None
+        self.documents = None
+        self.metadata = None
+        self.model = None
+
+        # Precomputed {normalized query: (ids, distances)} for the templated /generate query
+        self.table = None
+        self.table_top_k = 0
+        self.table_hits = 0
+        self.query_cache = LRUCache(query_cache_size)
+
+        # Concurrent cache misses are coalesced into one encode + one search
+        self.batcher = None
+        if microbatch_wait_ms > 0:
+            self.batcher = MicroBatcher(self._encode_and_search, max_batch=microbatch_max,
+                                        max_wait_ms=microbatch_wait_ms, name="rag-microbatch")
+
+        self.stage = "idle"
+        self.error = None
+        self.started_at = None
+        self.ready_at = None
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+    # ---------- lifecycle ----------
+    def start(self):
+        # Idempotent: only the first caller spawns the warm-up thread,
+        # a failed warm-up is retried on the next call
+        with self._lock:
+            if (self._thread is not None or self._ready.is_set()) and self.error is None:
+                return
+            self.error = None
+            self._ready.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._load, name="rag-warmup", daemon=True)
+            self._thread.start()
+
+    def attach(self, faiss_index, documents, model, table=None, table_top_k=0, metadata=None):
+        # Serve already loaded components instead of downloading them (benchmarks, offline tools)
+        with self._lock:
+            self.faiss_index = faiss_index
+            self.documents = documents
+            self.metadata = metadata
+            self.model = model
+            self.table, self.table_top_k = table, table_top_k
+            self.error = None
+            self.started_at = self.ready_at = time.time()
+            self.stage = "ready"
+            self._ready.set()
+        return self
+
+    def _set_stage(self, stage):
+        self.stage = stage
+        log.info("Warm-up stage: %s", stage)
+
+    def _load(self):
+        try:
+            self._set_stage("downloading")
+            if self.manifest_url:
+                download_file(self.manifest_url, self.manifest_path)
+            self.manifest = load_manifest(self.manifest_path)
+            if self.manifest is not None:
+                self._use_manifest(self.manifest)
+
+            if self.manifest is not None and not self.manifest_url:
+                # Locally built index: nothing to download
+                for path in (self.faiss_path, self.docstore_path):
+                    if not os.path.exists(path):
+                        raise FileNotFoundError(f"{path} listed in {self.manifest_path} is missing")
+            else:
+                self._download()
+
+            self._set_stage("loading_index")
+            self.faiss_index = read_faiss_index(self.faiss_path, mmap=self.mmap)
+            if self.manifest is not None:
+                if self.faiss_index.d != self.manifest["dim"]:
+                    raise ValueError(f"Index has dimension {self.faiss_index.d}, manifest says {self.manifest['dim']}")
+                apply_search_params(self.faiss_index, self.manifest["search_params"])
+            self._enable_reconstruct()
+
+            # Documents are memory-mapped: a lookup by FAISS id is a slice, not a resident object
+            self._set_stage("loading_documents")
+            if not os.path.exists(self.docstore_path):
+                # No prebuilt store configured (or RAG_DOCSTORE_FROM_PICKLE=1 after a failed fetch)
+                convert_pickle(self.docs_path, self.docstore_path)
+            self.documents = DocumentStore(self.docstore_path)
+
+            # Sector / region / framework / year postings for filtered search
+            self._set_stage("loading_metadata")
+            self.metadata = MetadataIndex.load_or_build(self.metadata_path, self.documents, self.corpus_sha256())
+
+            self._set_stage("loading_model")
+            # Backend imports (torch or onnxruntime) happen here so importing this module stays cheap
+            self.model = load_encoder(self.encoder_backend, self.model_name, self.onnx_dir)
+
+            self._set_stage("loading_table")
+            self.table, self.table_top_k = load_table(self.table_path, self.index_sha256())
+            if self.table is not None:
+                log.info("Loaded %d precomputed queries (top-%d)", len(self.table), self.table_top_k)
+
+            self.ready_at = time.time()
+            self._set_stage("ready")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            log.error("Warm-up failed during '%s': %s", self.stage, self.error)
+        finally:
+            # Wake up waiters on success and on failure alike
+            self._ready.set()
+
+    def _use_manifest(self, manifest):
+        # Files sit next to the manifest (locally) or under the same base URL (remotely)
+        base = os.path.dirname(self.manifest_path)
+        self.faiss_path = os.path.join(base, manifest["index_file"])
+        self.docstore_path = os.path.join(base, manifest["docstore_file"])
+        self.faiss_sha256 = manifest["sha256"]["index"]
+        self.docstore_sha256 = manifest["sha256"]["docstore"]
+        self.model_name = manifest["model"]
+        if self.manifest_url:
+            self.faiss_url = urljoin(self.manifest_url, manifest["index_file"])
+            self.docstore_url = urljoin(self.manifest_url, manifest["docstore_file"])
+        log.info("Index from manifest: %s (%s), %d vectors", manifest["index_type"], manifest["factory"],
+                 manifest["count"])
+
+    def _download(self):
+        download_file(self.faiss_url, self.faiss_path, self.faiss_sha256)
+        if not self.docstore_url:
+            # No prebuilt store published: convert the release pickle (once, see _load)
+            if not os.path.exists(self.docstore_path):
+                download_file(self.docs_url, self.docs_path, self.docs_sha256)
+            return
+        try:
+            download_file(self.docstore_url, self.docstore_path, self.docstore_sha256)
+            if self.docstore_sha256:
+                # Verified against the pin: no need to hash it again for the metadata key
+                record_digest(self.docstore_path, self.docstore_sha256.lower())
+        except ArtifactError as e:
+            if not self.docstore_from_pickle:
+                raise
+            log.warning("Document store unavailable (%s), converting %s instead", e, self.docs_url)
+            download_file(self.docs_url, self.docs_path, self.docs_sha256)
+
+    def _enable_reconstruct(self):
+        # IVF layouts need a direct map before vectors() can reconstruct stored embeddings
+        import faiss
+
+        ivf = faiss.try_extract_index_ivf(self.faiss_index)
+        if ivf is not None:
+            try:
+                ivf.make_direct_map()
+            except RuntimeError as e:
+                log.warning("No direct map for the IVF index (%s), de-duplication falls back to text", e)
+
+    def corpus_sha256(self):
+        # Postings are only valid for the exact docstore they were tagged from: the manifest records
+        # its hash, write_store records it next to a converted store
+        if self.manifest is not None:
+            return self.manifest["sha256"]["docstore"]
+        return store_digest(self.docstore_path)
+
+    def index_sha256(self):
+        return self.manifest["sha256"]["index"] if self.manifest is not None else self.faiss_sha256
+
+    def is_ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        self.start()
+        if not self._ready.wait(timeout):
+            raise EngineNotReady(f"RAG engine still warming up (stage: {self.stage})")
+        if self.error:
+            raise EngineNotReady(f"RAG engine failed to load: {self.error}")
+
+    def status(self):
+        now = time.time()
+        return {
+            "ready": self.is_ready(),
+            "stage": self.stage,
+            "progress": round(self.STAGES.index(self.stage) / (len(self.STAGES) - 1), 2),
+            "error": self.error,
+            "elapsed_seconds": round((self.ready_at or now) - self.started_at, 2) if self.started_at else None,
+            "documents": len(self.documents) if self.documents is not None else None,
+            "index_size": self.faiss_index.ntotal if self.faiss_index is not None else None,
+            "index_type": self.manifest["index_type"] if self.manifest is not None else "flat",
+            "metric": self.metric(),
+            "encoder": self.encoder_backend,
+            "metadata": self.metadata.stats() if self.metadata is not None else None,
+            "cache": self.cache_stats(),
+        }
+
+    def metric(self):
+        # "inner_product" or "l2", read from the loaded index (None before it is loaded)
+        import faiss
+
+        if self.faiss_index is None:
+            return None
+        return "inner_product" if self.faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+    def higher_is_better(self):
+        # Inner-product scores rank the other way round from L2 distances
+        return self.metric() == "inner_product"
+
+    def cache_stats(self):
+        return {
+            "table_size": len(self.table) if self.table is not None else 0,
+            "table_hits": self.table_hits,
+            "query_cache": self.query_cache.stats(),
+            "microbatch": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+    # ---------- retrieval ----------
+    def _encode_and_search(self, items):
+        # items: list of (query, top_k, filters); one encode for all of them, then one unfiltered
+        # search at the largest top_k (FAISS results are sorted, so slicing gives each caller its
+        # own top-k) and one search per distinct (filter set, top_k): whether filtered_search widens
+        # depends on top_k, so a larger k's results are not a prefix-safe superset of a smaller k's
+        queries = [query for query, _, _ in items]
+
+        RAG_BATCH_SIZE.observe(len(queries))
+        with RAG_ENCODE_SECONDS.time():
+            query_embeddings = np.asarray(self.model.encode(queries), dtype="float32")
+
+        groups = {}
+        for pos, (_, top_k, filters) in enumerate(items):
+            groups.setdefault((filter_key(filters), top_k) if filters else ("", 0), []).append(pos)
+
+        found = [None] * len(items)
+        # Search the FAISS index, restricted to the matching documents when filtered
+        with RAG_SEARCH_SECONDS.time():
+            for (fkey, _), positions in groups.items():
+                vectors = query_embeddings[positions]
+                max_k = max(items[pos][1] for pos in positions)
+                if fkey:
+                    results = filtered_search(self.faiss_index, self.metadata, vectors, max_k,
+                                              items[positions[0]][2], self.filter_min_hits)
+                else:
+                    D, I = self.faiss_index.search(vectors, max_k)
+                    results = zip(I, D)
+                for pos, (ids, distances) in zip(positions, results):
+                    top_k = items[pos][1]
+                    found[pos] = (ids[:top_k], distances[:top_k])
+        return found
+
+    def search_batch(self, queries, top_k=5, filters=None):
+        # filters: {"sector" | "region" | "framework" | "year": value or [values]}, see metadata_index;
+        # ignored when the engine has no metadata
+        fkey = filter_key(filters) if self.metadata is not None else ""
+        results = [None] * len(queries)
+        misses = []
+        for pos, query in enumerate(queries):
+            key = normalize_query(query)
+
+            # ✅ Known templated query: plain dict lookup, no model inference. Filtered entries were
+            # widened for table_top_k, so they only stand in for a search at exactly that k
+            entry = self.table.get(key) if self.table is not None and top_k <= self.table_top_k else None
+            if entry is not None and entry[2] == fkey and (not fkey or top_k == self.table_top_k):
+                self.table_hits += 1
+                ids, distances, _ = entry
+                results[pos] = (ids[:top_k], distances[:top_k])
+                continue
+
+            cached = self.query_cache.get((key, top_k, fkey))
+            if cached is not None:
+                results[pos] = cached
+            else:
+                misses.append(pos)
+
+        if misses:
+            # Filtered and unfiltered single-query calls share the micro-batcher; the batch is
+            # split by filter set only for the search itself
+            items = [(queries[pos], top_k, filters if fkey else None) for pos in misses]
+            if self.batcher is not None and len(items) == 1:
+                found = [self.batcher(items[0])]
+            else:
+                found = self._encode_and_search(items)
+            for pos, result in zip(misses, found):
+                self.query_cache.set((normalize_query(queries[pos]), top_k, fkey), result)
+                results[pos] = result
+        return results
+
+    def search(self, query, top_k=5, filters=None):
+        return self.search_batch([query], top_k, filters)[0]
+
+    def retrieve_context_batch(self, queries, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        self.wait_ready(timeout)
+        return [
+            [self.documents[i] for i in ids if i >= 0]
+            for ids, _ in self.search_batch(queries, top_k, filters)
+        ]
+
+    def retrieve_scored(self, query, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        # Like retrieve_context, but keeps the FAISS ids and distances: [(id, distance, doc)]
+        self.wait_ready(timeout)
+        ids, distances = self.search(query, top_k, filters)
+        return [(int(i), float(d), self.documents[i]) for i, d in zip(ids, distances) if i >= 0]
+
+    def vectors(self, ids):
+        # Stored embeddings for the given ids, or None when the index type cannot reconstruct them
+        try:
+            return np.vstack([self.faiss_index.reconstruct(int(i)) for i in ids])
+        except RuntimeError:
+            return None
+
+    def retrieve_context(self, query, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        self.wait_ready(timeout)
 
-def download_file(url, filepath):
-    if not os.path.exists(filepath):
-        print(f"[Download] Fetching {url}...")
-        r = requests.get(url)
-        r.raise_for_status()
-        with open(filepath, "wb") as f:
-            f.write(r.content)
-        print(f"[Download] Saved to {filepath}")
+        ids, _ = self.search(query, top_k, filters)
 
-# Ensure files exist locally
-download_file(DOCS_URL, DOCS_PATH)
-download_file(FAISS_URL, FAISS_PATH)
+        # Retrieve documents based on index positions (store always yields dicts)
+        results = [self.documents[i] for i in ids if i >= 0]
 
-# Load FAISS index
-faiss_index = faiss.read_index(FAISS_PATH)
+        # Content dumps are for debugging only (LOG_LEVEL=DEBUG), not for every request
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Top-%d results for query: %s", top_k, query)
+            for i, doc in enumerate(results, 1):
+                log.debug("%d. %s...", i, doc["content"][:150])
 
-# Load documents (list of dicts)
-with open(DOCS_PATH, "rb") as f:
-    documents = pickle.load(f)
+        return results
 
-# Load same embedding model used during index creation
-model = SentenceTransformer("all-MiniLM-L6-v2")  # or your actual model
 
+def make_engine():
+    # With RAG_SIDECAR_SOCKET set, workers query the shared retrieval_sidecar.py process
+    # instead of loading the model and index themselves
+    if os.getenv("RAG_SIDECAR_SOCKET"):
+        from retrieval_sidecar import RetrievalClient
+        return RetrievalClient()
+    return RAGEngine()
 
-def retrieve_context(query, top_k=5):
-    query_embedding = model.encode([query])
 
-    # Search the FAISS index
-    D, I = faiss_index.search(np.array(query_embedding), top_k)
+# Shared engine for the app; warm-up is kicked off by app.py at startup
+engine = make_engine()
 
-    # Retrieve documents based on index positions
-    results = [documents[i] for i in I[0]]
 
-    print(f"[RAG] Top-{top_k} results for query: {query}\n")
-    for i, doc in enumerate(results, 1):
-        if isinstance(doc, dict):
-            content = doc.get("content", "")
-        elif isinstance(doc, str):
-            content = doc
-            doc = {"content": content}
-            results[i - 1] = doc
-        else:
-            content = str(doc)
+def retrieve_context(query, top_k=5, timeout=READY_TIMEOUT, filters=None):
+    return engine.retrieve_context(query, top_k=top_k, timeout=timeout, filters=filters)
 
-        print(f"{i}. {content[:150]}...\n")
 
-    return results
+def retrieve_context_batch(queries, top_k=5, timeout=READY_TIMEOUT, filters=None):
+    return engine.retrieve_context_batch(queries, top_k=top_k, timeout=timeout, filters=filters)
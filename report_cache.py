@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from cache import TTLCache
+
+
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "256"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", str(24 * 3600)))
+# Optional on-disk layer shared by all workers on the box (disabled when unset)
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR")
+REPORT_CACHE_DISK_SIZE = int(os.getenv("REPORT_CACHE_DISK_SIZE", "2000"))
+# Queued/running jobs whose marker has not changed for this long are reported as lost
+REPORT_JOB_STALE_SECONDS = int(os.getenv("REPORT_JOB_STALE_SECONDS", "1800"))
+
+log = logging.getLogger(__name__)
+
+# Contact details collected at the end of the chat never reach the prompt
+IGNORED_FIELDS = {"email", "Name", "Phone_number"}
+
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def normalize_answers(data):
+    normalized = {}
+    for key, value in data.items():
+        if key in IGNORED_FIELDS:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        elif isinstance(value, list):
+            value = [" ".join(v.split()) if isinstance(v, str) else v for v in value]
+        normalized[key] = value
+    return normalized
+
+
+def report_key(data, prompt_version, report_date=""):
+    # Canonical JSON (sorted keys, no whitespace) so identical answers always hash the same
+    payload = {"answers": normalize_answers(data), "prompt_version": prompt_version, "date": report_date}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _process_alive(pid):
+    # The cache dir is local to the box, so the pid of the marker's writer can be checked directly
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _entry_size(entry):
+    return len(entry["html"])
+
+
+class ReportCache:
+    def __init__(self, maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL, max_bytes=REPORT_CACHE_MAX_BYTES,
+                 cache_dir=REPORT_CACHE_DIR, disk_maxsize=REPORT_CACHE_DISK_SIZE):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl, max_bytes=max_bytes, sizeof=_entry_size)
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.disk_maxsize = disk_maxsize
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def __contains__(self, key):
+        # Existence check that leaves the hit/miss counters alone (used for job polling)
+        if key in self.memory:
+            return True
+        if self.cache_dir and KEY_PATTERN.fullmatch(key or ""):
+            try:
+                return time.time() - os.path.getmtime(self._path(key)) < self.ttl
+            except OSError:
+                return False
+        return False
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+
+        # Keys come back from clients (job ids), never let them escape the cache dir
+        if self.cache_dir and KEY_PATTERN.fullmatch(key or ""):
+            path = self._path(key)
+            try:
+                if time.time() - os.path.getmtime(path) < self.ttl:
+                    with open(path, encoding="utf-8") as f:
+                        entry = json.load(f)
+                    self.disk_hits += 1
+                    # Promote to memory so the next hit skips the disk
+                    self.memory.set(key, entry)
+                    return entry
+                os.remove(path)
+            except (OSError, ValueError):
+                pass
+
+        self.misses += 1
+        return None
+
+    def set(self, key, html, profile=None):
+        entry = {"html": html, "profile": profile or {}}
+        self.memory.set(key, entry)
+
+        if self.cache_dir:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                self._prune_disk()
+            except OSError as e:
+                log.warning("Report cache write failed: %s", e)
+        return entry
+
+    # ---------- job markers ----------
+    # Only the worker that took a job holds it in memory; with REPORT_CACHE_DIR set, a small
+    # marker file lets every worker on the box answer a poll while the job is queued or running.
+    def _job_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.job")
+
+    def set_job_state(self, key, state, error=None):
+        if not self.cache_dir:
+            return
+        marker = {"job_id": key, "state": state, "error": error, "pid": os.getpid(), "updated_at": time.time()}
+        path = self._job_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(marker, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Job marker write failed: %s", e)
+
+    def clear_job_state(self, key):
+        if not self.cache_dir:
+            return
+        try:
+            os.remove(self._job_path(key))
+        except OSError:
+            pass
+
+    def job_state(self, key):
+        # {"job_id", "state", "error", "pid", "updated_at"} or None when no worker knows the job
+        if not self.cache_dir or not KEY_PATTERN.fullmatch(key or ""):
+            return None
+        try:
+            with open(self._job_path(key), encoding="utf-8") as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - marker["updated_at"]
+        if marker["state"] in ("queued", "running"):
+            if age > REPORT_JOB_STALE_SECONDS or not _process_alive(marker["pid"]):
+                return dict(marker, state="failed", error="Report job was lost (worker exited)")
+        elif age > self.ttl:
+            return None
+        return marker
+
+    def _prune_disk(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".job"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if time.time() - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        if len(files) <= self.disk_maxsize:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for path in files[:len(files) - self.disk_maxsize]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.disk_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory": memory,
+            "disk_hits": self.disk_hits,
+            "disk_enabled": bool(self.cache_dir),
+        }
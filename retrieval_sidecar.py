@@ -0,0 +1,427 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+from metrics import ERRORS, RAG_SIDECAR_SECONDS
+from rag_engine import READY_TIMEOUT, EngineNotReady, RAGEngine
+
+
+# One process owns the model, the FAISS index and the documents; web workers talk to it over a
+# Unix domain socket instead of each loading their own copy.
+#   python retrieval_sidecar.py                                  # start next to gunicorn
+#   RAG_SIDECAR_SOCKET=/tmp/rag-sidecar.sock gunicorn app:app    # workers become clients
+SIDECAR_SOCKET = os.getenv("RAG_SIDECAR_SOCKET", "/tmp/rag-sidecar.sock")
+# Idle connections kept per worker
+SIDECAR_POOL_SIZE = int(os.getenv("RAG_SIDECAR_POOL_SIZE", "8"))
+# Load the engine in-process when the sidecar cannot be reached (costs the memory it saves). The
+# warm-up starts in the background on the first failed connect, so /readyz reports that engine;
+# with the fallback off, readiness requires the sidecar
+SIDECAR_FALLBACK = os.getenv("RAG_SIDECAR_FALLBACK", "1") == "1"
+# After a failed connect, go straight to the fallback for this long before trying the sidecar again
+SIDECAR_RETRY_SECONDS = float(os.getenv("RAG_SIDECAR_RETRY_SECONDS", "10"))
+# All workers' queries meet here, so micro-batching pays off more than in a single worker
+SIDECAR_MICROBATCH_WAIT_MS = float(os.getenv("RAG_SIDECAR_MICROBATCH_WAIT_MS", "2"))
+
+# Frame: protocol version | op (request) or status (response) | payload length, then the payload.
+# Numbers are network order; ids are int64, distances and vectors float32, documents JSON.
+PROTOCOL_VERSION = 2
+FRAME = struct.Struct("!BBI")
+MAX_PAYLOAD = 64 * 1024 * 1024
+# Extra socket time on top of the engine's own ready timeout
+IO_MARGIN = 5.0
+
+OP_SCORED = 1          # top_k u16, timeout f32 (<0: none), [query, filters JSON] -> n u32, ids, distances, docs
+OP_CONTEXT_BATCH = 2   # top_k u16, timeout f32 (<0: none), [filters JSON, queries...] -> per query: n u32, docs
+OP_VECTORS = 3         # n u32, ids                           -> n u32, dim u32, vectors (empty: no vectors)
+OP_STATUS = 4          # -                                    -> JSON
+OP_NAMES = {OP_SCORED: "scored", OP_CONTEXT_BATCH: "context_batch", OP_VECTORS: "vectors", OP_STATUS: "status"}
+
+STATUS_OK = 0
+STATUS_NOT_READY = 1
+STATUS_ERROR = 2
+
+SEARCH = struct.Struct("!Hf")
+# timeout=None (wait for the warm-up however long it takes) travels as a negative timeout
+NO_TIMEOUT = -1.0
+COUNT = struct.Struct("!I")
+MATRIX = struct.Struct("!II")
+
+log = logging.getLogger(__name__)
+
+
+class SidecarUnavailable(ConnectionError):
+    pass
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# ---------- wire format ----------
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            raise ConnectionError("connection closed")
+        got += n
+    return bytes(buf)
+
+
+def send_frame(sock, code, payload=b""):
+    sock.sendall(FRAME.pack(PROTOCOL_VERSION, code, len(payload)) + payload)
+
+
+def recv_frame(sock):
+    version, code, size = FRAME.unpack(_recv_exact(sock, FRAME.size))
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"protocol version {version}, expected {PROTOCOL_VERSION}")
+    if size > MAX_PAYLOAD:
+        raise ProtocolError(f"payload of {size} bytes exceeds {MAX_PAYLOAD}")
+    return code, _recv_exact(sock, size) if size else b""
+
+
+def _pack_strings(values):
+    parts = [COUNT.pack(len(values))]
+    for value in values:
+        data = value.encode("utf-8")
+        parts += [COUNT.pack(len(data)), data]
+    return b"".join(parts)
+
+
+def _unpack_strings(buf, offset):
+    (n,), offset = COUNT.unpack_from(buf, offset), offset + COUNT.size
+    values = []
+    for _ in range(n):
+        (size,) = COUNT.unpack_from(buf, offset)
+        offset += COUNT.size
+        values.append(buf[offset:offset + size].decode("utf-8"))
+        offset += size
+    return values, offset
+
+
+def _pack_docs(docs):
+    return _pack_strings([json.dumps(doc, ensure_ascii=False, separators=(",", ":")) for doc in docs])
+
+
+def _unpack_docs(buf, offset):
+    values, offset = _unpack_strings(buf, offset)
+    return [json.loads(value) for value in values], offset
+
+
+def _unpack_array(buf, offset, dtype, count):
+    array = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+    return array, offset + array.nbytes
+
+
+def encode_scored(rows):
+    ids = np.array([doc_id for doc_id, _, _ in rows], dtype=">i8")
+    distances = np.array([distance for _, distance, _ in rows], dtype=">f4")
+    return COUNT.pack(len(rows)) + ids.tobytes() + distances.tobytes() + _pack_docs([doc for _, _, doc in rows])
+
+
+def decode_scored(buf):
+    (n,) = COUNT.unpack_from(buf, 0)
+    ids, offset = _unpack_array(buf, COUNT.size, ">i8", n)
+    distances, offset = _unpack_array(buf, offset, ">f4", n)
+    docs, _ = _unpack_docs(buf, offset)
+    return [(int(i), float(d), doc) for i, d, doc in zip(ids, distances, docs)]
+
+
+def encode_search(top_k, timeout):
+    return SEARCH.pack(top_k, NO_TIMEOUT if timeout is None else timeout)
+
+
+def decode_search(payload):
+    top_k, timeout = SEARCH.unpack_from(payload, 0)
+    return top_k, None if timeout < 0 else timeout
+
+
+# ---------- server ----------
+class _Handler(socketserver.BaseRequestHandler):
+    # One thread per worker connection; connections are long-lived and carry many requests
+    def handle(self):
+        while True:
+            try:
+                op, payload = recv_frame(self.request)
+            except (ConnectionError, ProtocolError, OSError):
+                return
+            try:
+                status, body = STATUS_OK, self.server.dispatch(op, payload)
+            except EngineNotReady as e:
+                status, body = STATUS_NOT_READY, str(e).encode("utf-8")
+            except Exception as e:
+                log.exception("Sidecar request failed (op %d)", op)
+                status, body = STATUS_ERROR, f"{type(e).__name__}: {e}".encode("utf-8")
+            try:
+                send_frame(self.request, status, body)
+            except OSError:
+                return
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, engine, path=SIDECAR_SOCKET):
+        self.engine = engine
+        if os.path.exists(path):
+            # Left over from a previous run; refuse to steal a live server's socket
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError(f"A sidecar is already listening on {path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+            finally:
+                probe.close()
+        super().__init__(path, _Handler)
+        # Only processes of the same user/group (the web workers) may query it
+        os.chmod(path, 0o660)
+
+    def dispatch(self, op, payload):
+        if op == OP_SCORED:
+            top_k, timeout = decode_search(payload)
+            (query, filters), _ = _unpack_strings(payload, SEARCH.size)
+            return encode_scored(self.engine.retrieve_scored(query, top_k=top_k, timeout=timeout,
+                                                             filters=json.loads(filters)))
+        if op == OP_CONTEXT_BATCH:
+            top_k, timeout = decode_search(payload)
+            (filters, *queries), _ = _unpack_strings(payload, SEARCH.size)
+            results = self.engine.retrieve_context_batch(queries, top_k=top_k, timeout=timeout,
+                                                         filters=json.loads(filters))
+            return COUNT.pack(len(results)) + b"".join(_pack_docs(docs) for docs in results)
+        if op == OP_VECTORS:
+            (n,) = COUNT.unpack_from(payload, 0)
+            ids, _ = _unpack_array(payload, COUNT.size, ">i8", n)
+            vectors = self.engine.vectors(ids.tolist())
+            if vectors is None:
+                return b""
+            vectors = np.ascontiguousarray(vectors, dtype=">f4")
+            return MATRIX.pack(*vectors.shape) + vectors.tobytes()
+        if op == OP_STATUS:
+            return json.dumps(dict(self.engine.status(), mode="sidecar", pid=os.getpid())).encode("utf-8")
+        raise ProtocolError(f"unknown op {op}")
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+# ---------- client ----------
+class RetrievalClient:
+    # Drop-in for the RAGEngine methods the app uses, answered by the sidecar. When the
+    # sidecar cannot be connected to, the calls go to an in-process engine, which starts
+    # warming up in the background on the first failed connect.
+    def __init__(self, path=SIDECAR_SOCKET, pool_size=SIDECAR_POOL_SIZE, fallback=SIDECAR_FALLBACK,
+                 engine_factory=RAGEngine, retry_seconds=SIDECAR_RETRY_SECONDS):
+        self.path = path
+        self.fallback = fallback
+        self.engine_factory = engine_factory
+        self.retry_seconds = retry_seconds
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._local = None
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._metric = None
+        self.requests = 0
+        self.fallbacks = 0
+
+    # ---------- connections ----------
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _release(self, sock):
+        try:
+            self._pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    def _drain(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, op, payload=b"", timeout=READY_TIMEOUT):
+        if time.monotonic() < self._down_until:
+            raise SidecarUnavailable(f"sidecar at {self.path} marked down")
+        try:
+            sock, pooled = self._pool.get_nowait(), True
+        except queue.Empty:
+            sock, pooled = None, False
+
+        start = time.perf_counter()
+        while True:
+            if sock is None:
+                try:
+                    sock = self._connect()
+                except OSError as e:
+                    self._down_until = time.monotonic() + self.retry_seconds
+                    if self.fallback:
+                        self._warm_fallback(e)
+                    raise SidecarUnavailable(f"cannot connect to {self.path}: {e}") from e
+            sock.settimeout(timeout + IO_MARGIN if timeout is not None else None)
+            try:
+                send_frame(sock, op, payload)
+                status, body = recv_frame(sock)
+                break
+            except (OSError, ProtocolError) as e:
+                # The stream may be mid-frame: never reuse this socket
+                sock.close()
+                sock = None
+                if not isinstance(e, ConnectionError):
+                    # A timeout or garbled answer from a live sidecar: the request failed, the
+                    # sidecar is not down, and neither a retry nor a second engine would help
+                    raise RuntimeError(f"Retrieval sidecar request failed: {type(e).__name__}: {e}") from e
+                if not pooled:
+                    raise SidecarUnavailable(f"sidecar connection lost: {e}") from e
+                # Pooled connections go stale when the sidecar restarts; every op is
+                # idempotent, so retry once on a fresh connection
+                self._drain()
+                pooled = False
+        self._release(sock)
+        RAG_SIDECAR_SECONDS.observe(time.perf_counter() - start, op=OP_NAMES[op])
+        self.requests += 1
+
+        if status == STATUS_NOT_READY:
+            raise EngineNotReady(body.decode("utf-8"))
+        if status != STATUS_OK:
+            raise RuntimeError(f"Retrieval sidecar error: {body.decode('utf-8')}")
+        return body
+
+    def _warm_fallback(self, error):
+        # start() only spawns the warm-up thread, so this is cheap enough for the request path
+        with self._lock:
+            if self._local is None:
+                log.warning("Retrieval sidecar unavailable (%s), loading the engine in-process", error)
+                self._local = self.engine_factory()
+            self._local.start()
+        return self._local
+
+    def _local_engine(self, error):
+        if not self.fallback:
+            raise EngineNotReady(f"Retrieval sidecar unavailable: {error}")
+        local = self._warm_fallback(error)
+        self.fallbacks += 1
+        ERRORS.inc(stage="rag_sidecar")
+        return local
+
+    # ---------- engine interface ----------
+    def start(self):
+        # The sidecar warms itself up; an already loaded fallback engine keeps its state
+        if self._local is not None:
+            self._local.start()
+
+    def retrieve_scored(self, query, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        payload = encode_search(top_k, timeout) + _pack_strings([query, json.dumps(filters)])
+        try:
+            return decode_scored(self._request(OP_SCORED, payload, timeout))
+        except SidecarUnavailable as e:
+            return self._local_engine(e).retrieve_scored(query, top_k=top_k, timeout=timeout, filters=filters)
+
+    def retrieve_context(self, query, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        return [doc for _, _, doc in self.retrieve_scored(query, top_k=top_k, timeout=timeout, filters=filters)]
+
+    def retrieve_context_batch(self, queries, top_k=5, timeout=READY_TIMEOUT, filters=None):
+        payload = encode_search(top_k, timeout) + _pack_strings([json.dumps(filters)] + list(queries))
+        try:
+            body = self._request(OP_CONTEXT_BATCH, payload, timeout)
+        except SidecarUnavailable as e:
+            return self._local_engine(e).retrieve_context_batch(queries, top_k=top_k, timeout=timeout,
+                                                                filters=filters)
+        (n,) = COUNT.unpack_from(body, 0)
+        offset, results = COUNT.size, []
+        for _ in range(n):
+            docs, offset = _unpack_docs(body, offset)
+            results.append(docs)
+        return results
+
+    def vectors(self, ids):
+        ids = np.asarray(ids, dtype=">i8")
+        try:
+            body = self._request(OP_VECTORS, COUNT.pack(len(ids)) + ids.tobytes())
+        except SidecarUnavailable as e:
+            return self._local_engine(e).vectors(ids.tolist())
+        if not body:
+            return None
+        n, dim = MATRIX.unpack_from(body, 0)
+        vectors, _ = _unpack_array(body, MATRIX.size, ">f4", n * dim)
+        return vectors.astype("float32").reshape(n, dim)
+
+    def status(self):
+        try:
+            status = json.loads(self._request(OP_STATUS, timeout=2.0))
+        except (SidecarUnavailable, RuntimeError) as e:
+            # A failed connect has started the fallback warm-up (when enabled): its state is what
+            # requests hit now, so readiness follows it instead of the missing sidecar
+            if self._local is None:
+                status = {"ready": False, "stage": "sidecar_unavailable", "error": str(e), "mode": "sidecar",
+                          "fallback": self.fallback}
+            else:
+                status = dict(self._local.status(), mode="in_process")
+        status["client"] = self.stats()
+        return status
+
+    def is_ready(self):
+        return bool(self.status()["ready"])
+
+    def higher_is_better(self):
+        # The index metric does not change while the sidecar runs: ask once it is known
+        if self._metric is None:
+            self._metric = self.status().get("metric")
+        return self._metric == "inner_product"
+
+    def cache_stats(self):
+        return self.status().get("cache") or {}
+
+    def stats(self):
+        return {
+            "socket": self.path,
+            "requests": self.requests,
+            "fallbacks": self.fallbacks,
+            "idle_connections": self._pool.qsize(),
+        }
+
+
+def main(argv=None):
+    from tracing import configure_logging
+
+    parser = argparse.ArgumentParser(description="Serve RAG retrieval over a Unix domain socket")
+    parser.add_argument("--socket", default=SIDECAR_SOCKET)
+    parser.add_argument("--microbatch-wait-ms", type=float, default=SIDECAR_MICROBATCH_WAIT_MS)
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    engine = RAGEngine(microbatch_wait_ms=args.microbatch_wait_ms)
+    engine.start()
+    server = RetrievalServer(engine, args.socket)
+    log.info("Retrieval sidecar listening on %s", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
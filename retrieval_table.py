@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+
+
+# Button options from static/chatbot.js (keep in sync with the chatbot flow)
+REGIONS = [
+    "North America",
+    "Latin America",
+    "Europe (Western)",
+    "Europe (Eastern)",
+    "Middle East (excl. KSA)",
+    "KSA (Saudi Arabia)",
+    "Africa (Sub-Saharan)",
+    "Africa (North)",
+    "Asia (East)",
+    "Asia (South)",
+    "Asia (Southeast)",
+    "Central Asia",
+    "Oceania",
+]
+
+COMPANY_SIZES = [
+    "0 - 100",
+    "101 - 500",
+    "501 - 1000",
+    "1001 - 2000",
+    "2001 & above",
+]
+
+# sector_industry is a free-text answer, so only the most common values are precomputed;
+# anything else falls back to the LRU cache in rag_engine
+SECTORS = [
+    "Renewable Energy",
+    "Oil & Gas",
+    "Utilities",
+    "Mining",
+    "Manufacturing",
+    "Automotive",
+    "Chemicals",
+    "Construction",
+    "Real Estate",
+    "Pharmaceuticals",
+    "Healthcare",
+    "AgriTech",
+    "Agriculture",
+    "Food & Beverage",
+    "Retail",
+    "Apparel",
+    "Consumer Goods",
+    "Technology",
+    "Enterprise Software",
+    "Telecommunications",
+    "Financial Services",
+    "Banking",
+    "Insurance",
+    "Logistics",
+    "Transportation",
+    "Aviation",
+    "Hospitality",
+    "Education",
+]
+
+TABLE_PATH = os.getenv("RAG_TABLE_PATH", "retrieval_table.json")
+
+
+def build_query(company_size, sector_industry, region):
+    return f"Sustainability roadmap for a {company_size} company in the {sector_industry} sector located in {region}, with focus on climate impact, energy consumption, emissions, and sustainability goals."
+
+
+def normalize_query(query):
+    # Case and whitespace differences should not miss the table
+    return " ".join(query.lower().split())
+
+
+def enumerate_queries(sizes=COMPANY_SIZES, sectors=SECTORS, regions=REGIONS):
+    return [build_query(size, sector, region) for size in sizes for sector in sectors for region in regions]
+
+
+def build_table(model, faiss_index, queries, top_k=5, batch_size=128, filters=None, metadata=None):
+    # One batched encode and one batched search for every known query. With `filters` (one per
+    # query) and the engine's metadata, each entry holds the filtered result and its filter key.
+    embeddings = np.asarray(model.encode(queries, batch_size=batch_size), dtype="float32")
+    if filters is None or metadata is None:
+        D, I = faiss_index.search(embeddings, top_k)
+        return {
+            normalize_query(q): {"ids": I[row].tolist(), "distances": D[row].tolist()}
+            for row, q in enumerate(queries)
+        }
+
+    from metadata_index import filter_key, filtered_search
+
+    # Queries sharing a sector and region share one selector: search them as a group
+    groups = {}
+    for row, query_filters in enumerate(filters):
+        groups.setdefault(filter_key(query_filters), (query_filters, []))[1].append(row)
+    table = {}
+    for key, (query_filters, rows) in groups.items():
+        found = filtered_search(faiss_index, metadata, embeddings[rows], top_k, query_filters)
+        for row, (ids, distances) in zip(rows, found):
+            table[normalize_query(queries[row])] = {"ids": ids.tolist(), "distances": distances.tolist(),
+                                                   "filters": key}
+    return table
+
+
+def save_table(table, path, top_k, model_name, index_sha256=None):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"top_k": top_k, "model": model_name, "index": index_sha256, "queries": table}, f)
+    os.replace(tmp_path, path)
+
+
+def load_table(path, index_sha256=None):
+    # With index_sha256 set, a table precomputed against a different index is ignored
+    if not os.path.exists(path):
+        return None, 0
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+    if index_sha256 is not None and payload.get("index") != index_sha256:
+        return None, 0
+    # Entries carry the filter key they were searched with ("" = unfiltered)
+    table = {q: (np.array(v["ids"], dtype="int64"), np.array(v["distances"], dtype="float32"), v.get("filters", ""))
+             for q, v in payload["queries"].items()}
+    return table, payload["top_k"]
+
+
+if __name__ == "__main__":
+    # Usage: python retrieval_table.py [top_k] [output path]
+    from metadata_index import FILTERS_ENABLED, query_filters
+    from rag_engine import RAGEngine
+
+    # Wide enough for the context builder's over-fetch (CONTEXT_CANDIDATES)
+    top_k = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    path = sys.argv[2] if len(sys.argv) > 2 else TABLE_PATH
+
+    # The table needs the model and index themselves, which a sidecar client does not hold
+    engine = RAGEngine()
+    engine.wait_ready(timeout=None)
+    queries = enumerate_queries()
+    # Same filters app.py derives from the questionnaire, so the entries match live requests
+    filters = None
+    if FILTERS_ENABLED:
+        filters = [query_filters({"sector_industry": sector, "region": region})
+                   for _ in COMPANY_SIZES for sector in SECTORS for region in REGIONS]
+    start = time.time()
+    table = build_table(engine.model, engine.faiss_index, queries, top_k=top_k, filters=filters,
+                        metadata=engine.metadata)
+    save_table(table, path, top_k, engine.model_name, engine.index_sha256())
+    print(f"[Table] Precomputed {len(table)} queries (top-{top_k}) in {time.time() - start:.1f}s -> {path}")
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from cache import TTLCache
+from metrics import ERRORS, LLM_SECONDS, PROMPT_CHARS, observe_usage
+from prompts import PERSONA, RAG_HEADER, field_value, prompt_version
+from streaming import clean_fences
+from tracing import submit_with_context
+
+
+SECTION_PARALLELISM = int(os.getenv("REPORT_SECTION_PARALLELISM", "6"))
+SECTION_CACHE_SIZE = int(os.getenv("REPORT_SECTION_CACHE_SIZE", "2048"))
+SECTION_CACHE_TTL = int(os.getenv("REPORT_SECTION_CACHE_TTL", str(24 * 3600)))
+
+APPROACH = """Analytical Approach:
+For each topic, you must follow a three-part structure:
+•    Current Status (Observation): Synthesize the relevant input data points into a clear narrative. State what the company is currently doing or where information is lacking.
+•    Expert Analysis & Gap Identification: Analyze the current status. Benchmark it against what leading companies in the industry are doing and what frameworks like TCFD or CSRD require. Clearly state the strategic gaps, risks, or missed opportunities.
+•    Actionable Recommendations: Provide specific, concrete recommendations to close the identified gaps. Recommendations should be practical and prioritize actions that have the highest impact.
+If data is missing, write "Data not available" but still generate the full section."""
+
+HTML_RULES = """HTML Formatting & Style:
+•    Strictly adhere to the specified HTML structure: <h2> for the section heading, <h3> for subheadings, and <p>, <ul>, <li>, <div> for content.
+•    Do NOT add a main title like "Sustainability Report," as this is handled by the application.
+•    Use inline CSS to style tables, lists, and headers for a clean, modern look that converts well to PDF. Use a professional font-family like 'Inter', 'Helvetica', or 'Arial'.
+•    For tables: wrap them in <div style="page-break-inside: avoid;"> and use <table style="page-break-inside: avoid; width:100%; border-collapse: collapse;"> to ensure they fit on a single page without breaking.
+•    Output only the HTML of the requested section, nothing before or after it."""
+
+# Shared by every section call; sent as the system instruction so only the section-specific
+# part varies between requests
+SECTION_INSTRUCTION = "\n\n".join([PERSONA, APPROACH, HTML_RULES])
+
+
+class Section:
+    def __init__(self, number, title, fields, spec, depends_on=()):
+        self.number = number
+        self.title = title
+        self.fields = fields
+        self.spec = spec
+        self.depends_on = tuple(depends_on)
+
+
+ANALYSIS = (4, 5, 6, 7, 8, 9, 10, 11)
+
+# Section scaffold of the report: each section lists the questionnaire fields it reads,
+# summary sections list the sections they draw on instead
+SECTIONS = [
+    Section(1, "Company Profile",
+            ["company_name", "region", "major_countries", "sector_industry", "company_size",
+             "listing_status", "total_emissions", "report_date"],
+            """(Use the data points to build the profile in a structured format with bullet points or a table: Company Name, Region, Countries of Operation, Sector & Industry, Company Size, Listing Status, Total GHG Emissions, Date of Report.)
+At the bottom of this section, always include the following disclaimer in italic style:
+"This report is generated automatically using AI and provided data. Please review and verify the accuracy of the content before publishing or making business decisions.\""""),
+    Section(2, "Maturity Level",
+            ["score_total", "score_level", "score_level_name", "confidence"],
+            """Use the score values to describe the maturity level of the company.
+Explain what this maturity level means for the company in terms of sustainability journey."""),
+    Section(3, "Executive Summary", ["company_name", "sector_industry", "score_level_name"],
+            """a. Purpose of the Report
+(State the report's goal: to provide a comprehensive assessment of the company's current ESG maturity and a strategic roadmap for improvement.)
+b. Findings based on AI diagnostic
+(Summarize the most critical findings from the analysis sections, highlighting 3-4 key strengths and 3-4 major areas for development.)
+c. Recommendations
+(List the top 3-5 most impactful, high-priority recommendations that will drive the sustainability strategy forward.)""",
+            depends_on=ANALYSIS),
+    Section(4, "Governance & Strategy",
+            ["sustainability_strategy", "governance_accountability", "materiality_assessment", "erm_esg",
+             "incentives_performance", "framework_alignment", "policies_monitoring"],
+            """(Analyze data points: sustainability_strategy, governance_accountability, materiality_assessment, erm_esg, incentives_performance, framework_alignment, policies_monitoring.)"""),
+    Section(5, "Climate Strategy & Transition Plan",
+            ["scope_coverage", "netzero_targets", "decarbonization_plan", "carbon_pricing",
+             "transition_plan", "climate_disclosure"],
+            """a. Greenhouse Gas (GHG) Inventory
+(Analyze scope_coverage.)
+b. Targets & SBTi Pathway
+(Analyze netzero_targets.)
+c. Decarbonization Levers & Capex Plan
+(Analyze decarbonization_plan and carbon_pricing.)
+d. Climate Risk & Resilience
+(Analyze transition_plan.)
+e. Disclosure
+(Analyze climate_disclosure.)"""),
+    Section(6, "Energy, Resources & Circularity",
+            ["energy_management", "renewables_adoption", "electrification_energy", "waste_management",
+             "waste_diverted", "product_sustainability", "biodiversity_nature", "green_buildings"],
+            """a. Energy management
+(Analyze energy_management.)
+b. Renewables
+(Analyze renewables_adoption.)
+c. Electrification & decentralized energy
+(Analyze electrification_energy.)
+d. Waste
+(Analyze waste_management and waste_diverted.)
+e. Product/service sustainability
+(Analyze product_sustainability.)
+f. Biodiversity & nature
+(Analyze biodiversity_nature.)
+g. Green buildings
+(Analyze green_buildings.)"""),
+    Section(7, "Water Stewardship",
+            ["water_measurement", "water_risk", "water_efficiency", "nature_based_solutions"],
+            """a. Measurement
+(Analyze water_measurement.)
+b. Basin stress mapping
+(Analyze water_risk.)
+c. Efficiency & reuse
+(Analyze water_efficiency.)
+d. Nature-based solutions
+(Analyze nature_based_solutions.)"""),
+    Section(8, "Supply Chain & Procurement",
+            ["supplier_esg", "purchased_goods", "sustainable_procurement"],
+            """a. Supplier ESG expectations
+(Analyze supplier_esg.)
+b. Scope 3 - purchased goods/services
+(Analyze purchased_goods.)
+c. Sustainable procurement
+(Analyze sustainable_procurement.)"""),
+    Section(9, "People, Culture & Training",
+            ["esg_training", "staff_green"],
+            """a. Training curriculum
+(Analyze esg_training.)
+b. Employee engagement
+(Analyze staff_green.)
+c. DEI & community
+(Expand on the importance of social metrics, even if not explicitly in the data, as a key part of a holistic strategy.)"""),
+    Section(10, "Data, Systems & Reporting",
+            ["data_systems", "reporting_quality", "framework_alignment"],
+            """a. Systems
+(Analyze data_systems.)
+b. Controls
+(Recommend data verification and assurance processes.)
+c. Reporting
+(Analyze reporting_quality and framework_alignment.)"""),
+    Section(11, "External Signals & Green Finance",
+            ["ratings_certifications", "green_finance"],
+            """a. Ratings/certifications
+(Analyze ratings_certifications.)
+b. Green finance readiness
+(Analyze green_finance.)"""),
+    Section(12, "Five-Year Roadmap (2026-2030)", [],
+            """(Create a table or structured list for the roadmap, ensuring each year's initiatives are derived from the recommendations in the analysis sections. Each year's initiatives should logically build upon the previous one.)
+a. 2026 — Planning & Foundation
+b. 2027 — Measurement & Reduction
+c. 2028 — Circularity & Engagement
+d. 2029 — Certification & Reporting
+e. 2030 — Science-Based Targets & Innovation""",
+            depends_on=ANALYSIS),
+    Section(13, "KPIs & Targets", [],
+            """(Propose specific, measurable, achievable, relevant, and time-bound (SMART) targets in a table format for each category. Instead of a generic "Reduce Waste," propose a target like "Reduce non-hazardous waste to landfill by 25% from a 2025 baseline by 2028.")
+a. GHG: S1+S2
+b. Energy
+c. Water
+d. Waste
+e. People
+f. Supply chain
+g. Data/assurance""",
+            depends_on=(12,)),
+    Section(14, "Dependencies, Risks & Mitigations", [],
+            """(Outline potential challenges to implementing the roadmap in a structured list.)
+a. Data availability
+b. Budget/capex
+c. Change management""",
+            depends_on=(12,)),
+]
+
+SECTION_PROMPT_VERSION = prompt_version(SECTION_INSTRUCTION, *(
+    f"{s.number}|{s.title}|{','.join(s.fields)}|{s.depends_on}|{s.spec}" for s in SECTIONS))
+
+TAG = re.compile(r"<[^>]+>")
+H2_OPEN = re.compile(r"<h2[^>]*>", flags=re.IGNORECASE)
+
+
+def section_key(section, data, rag_context, dependency_keys, prompt_version):
+    # Only the section's own fields (plus what it draws on) go into the key, so changing
+    # one answer invalidates just the sections that read it
+    payload = {
+        "version": prompt_version,
+        "section": section.number,
+        "fields": {field: field_value(data, field) for field in section.fields},
+        "context": hashlib.sha256(rag_context.encode("utf-8")).hexdigest(),
+        "depends_on": dependency_keys,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def build_section_prompt(section, data, rag_context, dependencies):
+    # The per-request part; SECTION_INSTRUCTION carries the rest
+    parts = [RAG_HEADER + "\n" + rag_context]
+    if section.fields:
+        parts.append("[COMPANY DATA]\n" + "\n".join(
+            f'•    {field}: "{field_value(data, field)}"' for field in section.fields))
+    if dependencies:
+        # Summary sections read the finished analysis as plain text to keep the prompt short
+        parts.append("[REPORT SECTIONS ALREADY WRITTEN]\n" + "\n\n".join(
+            TAG.sub(" ", html) for _, html in dependencies))
+    parts.append(
+        f"[AI OUTPUT REQUIRED]\nGenerate ONLY section {section.number} of the report as HTML, "
+        f"starting with <h2>{section.number}. {section.title}</h2>:\n{section.spec}"
+    )
+    return "\n\n".join(parts)
+
+
+def normalize_section(section, html):
+    html = clean_fences(html).strip()
+    # Every section after the first starts on a new page in the PDF
+    heading = "<h2>" if section.number == 1 else '<h2 style="page-break-before: always;">'
+    if H2_OPEN.search(html):
+        return H2_OPEN.sub(heading, html, count=1)
+    return f"{heading}{section.number}. {section.title}</h2>\n{html}"
+
+
+class SectionEngine:
+    def __init__(self, max_workers=SECTION_PARALLELISM, cache_size=SECTION_CACHE_SIZE,
+                 cache_ttl=SECTION_CACHE_TTL, sections=SECTIONS):
+        self.sections = {s.number: s for s in sections}
+        self.order = [s.number for s in sections]
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-section")
+        self.generated = 0
+
+    def _generate(self, llm, section, prompt):
+        PROMPT_CHARS.observe(len(prompt), mode="section")
+        try:
+            with LLM_SECONDS.time(mode="section"):
+                response = llm.generate_content(prompt, request_options={"timeout": 180})
+        except Exception:
+            ERRORS.inc(stage="llm")
+            raise
+        observe_usage(response, "section")
+        self.generated += 1
+        return normalize_section(section, response.text)
+
+    def generate(self, llm, data, rag_context, prompt_version, on_section=None):
+        # Independent sections fan out at once; summary sections start as soon as the
+        # sections they draw on are finished. on_section(number, html) is called in report order.
+        html = {}
+        keys = {}
+        running = {}
+        emitted = 0
+
+        def emit_ready():
+            nonlocal emitted
+            while emitted < len(self.order) and self.order[emitted] in html:
+                number = self.order[emitted]
+                if on_section is not None:
+                    on_section(number, html[number])
+                emitted += 1
+
+        def schedule_pass():
+            for number in self.order:
+                section = self.sections[number]
+                if number in html or number in running.values():
+                    continue
+                if any(dep not in html for dep in section.depends_on):
+                    continue
+                dep_keys = [keys[dep] for dep in section.depends_on]
+                key = section_key(section, data, rag_context, dep_keys, prompt_version)
+                keys[number] = key
+                cached = self.cache.get(key)
+                if cached is not None:
+                    html[number] = cached
+                    continue
+                dependencies = [(dep, html[dep]) for dep in section.depends_on]
+                prompt = build_section_prompt(section, data, rag_context, dependencies)
+                running[submit_with_context(self.executor, self._generate, llm, section, prompt)] = number
+
+        def schedule():
+            # A cache hit can unlock dependents, so keep scheduling until nothing changes
+            while True:
+                before = (len(html), len(running))
+                schedule_pass()
+                if (len(html), len(running)) == before:
+                    break
+            emit_ready()
+
+        schedule()
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                number = running.pop(future)
+                html[number] = future.result()
+                self.cache.set(keys[number], html[number])
+            schedule()
+
+        return "\n\n".join(html[number] for number in self.order)
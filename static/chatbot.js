@@ -6,7 +6,13 @@ let currentChatId = null; // reserved for future use
 
 /* -------- Boot -------- */
 document.addEventListener("DOMContentLoaded", () => {
-  nextStep();
+  if (window.REPORT_STREAM_URL && window.EventSource) {
+    streamReportJob(window.REPORT_STREAM_URL, window.REPORT_JOB_URL);
+  } else if (window.REPORT_JOB_URL) {
+    pollReportJob(window.REPORT_JOB_URL);
+  } else if (document.getElementById("chat-box")) {
+    nextStep();
+  }
 });
 
 /* =========================================================
@@ -672,4 +678,62 @@ async function validateEmailWithAPI(email) {
     console.error("Email validation failed:", err);
     return false;
   }
-}
\ No newline at end of file
+}
+
+/* =========================================================
+   REPORT JOB POLLING (report is generated in the background)
+========================================================= */
+async function pollReportJob(statusUrl, intervalMs = 2000, misses = 0) {
+  const statusEl = document.getElementById("job-status");
+  try {
+    const response = await fetch(statusUrl, { cache: "no-store" });
+    const job = await response.json();
+
+    if (job.state === "done") {
+      window.location.href = job.report_url;
+      return;
+    }
+    // A 404 can come from a worker that does not know the job yet, only give up once it repeats
+    misses = response.status === 404 ? misses + 1 : 0;
+    if (job.state === "failed" || misses > 5) {
+      if (statusEl) statusEl.innerHTML = "❌ Sorry, we could not generate your roadmap. Please try again.";
+      return;
+    }
+  } catch (err) {
+    console.error("Report status check failed:", err);
+  }
+  setTimeout(() => pollReportJob(statusUrl, intervalMs, misses), intervalMs);
+}
+
+/* =========================================================
+   REPORT STREAMING (render sections as the model writes them)
+========================================================= */
+function streamReportJob(streamUrl, statusUrl) {
+  const wrapper = document.getElementById("stream-wrapper");
+  const content = document.getElementById("stream-content");
+  const statusEl = document.getElementById("job-status");
+  const source = new EventSource(streamUrl);
+  let html = "";
+
+  source.addEventListener("chunk", (e) => {
+    html += JSON.parse(e.data).html;
+    if (wrapper) wrapper.style.display = "";
+    if (content) content.innerHTML = html;
+  });
+
+  source.addEventListener("done", (e) => {
+    source.close();
+    window.location.href = JSON.parse(e.data).report_url;
+  });
+
+  source.addEventListener("failed", () => {
+    source.close();
+    if (statusEl) statusEl.innerHTML = "❌ Sorry, we could not generate your roadmap. Please try again.";
+  });
+
+  // Connection dropped (proxy timeout, worker restart): fall back to polling
+  source.onerror = () => {
+    source.close();
+    if (statusUrl) pollReportJob(statusUrl);
+  };
+}
@@ -0,0 +1,83 @@
+import re
+import threading
+
+
+OPEN_FENCE = re.compile(r"```(?:html)?\s*", flags=re.IGNORECASE)
+# Trailing run of backticks (plus a partial "html" tag and whitespace) that may still grow into a fence
+PARTIAL_FENCE = re.compile(r"`+(?:h(?:t(?:m(?:l)?)?)?)?\s*$", flags=re.IGNORECASE)
+
+
+def clean_fences(text):
+    cleaned = OPEN_FENCE.sub("", text)
+    return cleaned.replace("```", "")
+
+
+class FenceStripper:
+    # Incremental version of the ``` cleanup in app.build_report: feed() model chunks in,
+    # get cleaned text out. Fences split across chunks are held back until complete, and
+    # the output matches clean_fences(full_text).strip().
+    def __init__(self):
+        self._pending = ""
+        self._carry = ""
+        self._started = False
+
+    def _emit(self, cleaned, final=False):
+        out = self._carry + cleaned
+        if not self._started:
+            out = out.lstrip()
+        body = out.rstrip()
+        # Trailing whitespace is only emitted once more text follows it
+        self._carry = "" if final else out[len(body):]
+        if body:
+            self._started = True
+        return body
+
+    def feed(self, chunk):
+        self._pending += chunk
+        match = PARTIAL_FENCE.search(self._pending)
+        cut = match.start() if match else len(self._pending)
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._emit(clean_fences(ready))
+
+    def finish(self):
+        ready, self._pending = self._pending, ""
+        return self._emit(clean_fences(ready), final=True)
+
+
+class ReportStream:
+    # Append-only text buffer that any number of readers can follow while it grows
+    def __init__(self):
+        self._chunks = []
+        self._cond = threading.Condition()
+        self.closed = False
+        self.error = None
+
+    def append(self, text):
+        if not text:
+            return
+        with self._cond:
+            self._chunks.append(text)
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self.closed = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self, timeout=15):
+        # Yields new chunks as they arrive; yields None on idle timeouts so callers can send keep-alives
+        position = 0
+        while True:
+            with self._cond:
+                if position == len(self._chunks) and not self.closed:
+                    self._cond.wait(timeout)
+                chunks = self._chunks[position:]
+                closed = self.closed
+            position += len(chunks)
+            if chunks:
+                yield "".join(chunks)
+            elif closed:
+                return
+            else:
+                yield None
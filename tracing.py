@@ -0,0 +1,55 @@
+import contextvars
+import logging
+import os
+import re
+import uuid
+
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"
+# Incoming header honoured as the trace id (set by a proxy or the caller), echoed on the response
+TRACE_HEADER = "X-Request-ID"
+# Caller-supplied ids end up in log lines, so only short, plain tokens are accepted
+VALID_TRACE_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_trace_id():
+    return _trace_id.get()
+
+
+def set_trace_id(trace_id):
+    # Returns a token for reset_trace_id(); threads started with copy_context() inherit the id
+    if not trace_id or not VALID_TRACE_ID.fullmatch(trace_id):
+        trace_id = new_trace_id()
+    return _trace_id.set(trace_id)
+
+
+def reset_trace_id(token):
+    _trace_id.reset(token)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    # executor.submit, but the task sees the caller's trace id
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = get_trace_id()
+        return True
+
+
+def configure_logging(level=None):
+    # LOG_LEVEL=DEBUG also logs the retrieved document snippets for every query
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(TraceIdFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)